@@ -0,0 +1,684 @@
+import os
+import re
+import sys
+import time
+import numpy as np
+import hw3
+
+# Benchmarks and consistency checks for hw3.py. Each benchmark is a
+# function named bench<Name>(); run one or more of them by name, e.g.,
+#
+#   python bench.py tokenizer
+#
+# or run them all with no arguments.
+
+# The speech files in the corpus directory, including the unknowns.
+def corpusFiles(directory="corpus/"):
+    return(sorted([ directory + f for f in os.listdir(directory) if f.endswith('.txt') ]))
+
+# The names of the known speeches in the corpus: four for each
+# president in hw3.P.
+def speechNames():
+    return([ p + str(i) for p in hw3.P for i in range(4) ])
+
+# Add word frequency tables (a dictionary of them, keyed by speech
+# name) to the corpus as Speeches with no file, without reading any
+# files, and return the corpus.
+def addTables(corpus, tables):
+    for name, wfreq in tables.items():
+        corpus.speeches[name] = hw3.Speech.restore(None, None, None, wfreq, sum(wfreq.values()))
+        corpus.updateFreqs(corpus.speeches[name])
+    return(corpus)
+
+# Reference copy of the original (per-word, multi-pass) normalization
+# pipeline from Speech.__init__(), used to check that hw3.normalize()
+# produces exactly the same text.
+def legacyNormalize(text):
+    def expandWord(word):
+        i = 0
+        while "'" in word and i < len(hw3.REGEXP):
+            word =re.sub(hw3.REGEXP[i][0], hw3.REGEXP[i][1], word)
+            i = i+1
+        return(word)
+    def expandText(text):
+        return(''.join([expandWord(word) for word in text.split()]))
+    def flushMarks(m):
+        if m.group(1) in ('--', '-', '—', '_'):
+            return(' ')
+        elif m.group(1) in ('(', ')', ',', ':', '\'', '"', '...'):
+            return('')
+        elif m.group(1) in ('?', '!'):
+            return('.')
+    return(re.sub("\\s+"," ",re.sub('(--|-|—|_|\\(|\\)|,|:|\'|"|\\.\\.\\.|\\?|!)',flushMarks,expandText(text))).strip())
+
+# Time fn(*args) over the given number of repeats, returning the best
+# wall time in seconds.
+def best(fn, *args, repeat=3):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return(min(times))
+
+# Check hw3.normalize() (and the sentences, words and wfreq derived
+# from it by Speech) against the legacy pipeline over every file in
+# the corpus, then compare throughput in tokens/s.
+def benchTokenizer():
+    texts = []
+    for filename in corpusFiles():
+        with open(filename, 'r') as infile:
+            texts.append(infile.read())
+    for filename, text in zip(corpusFiles(), texts):
+        expected = legacyNormalize(text)
+        speech = hw3.Speech(filename)
+        words = [ word.strip('.').strip() for word in expected.lower().split() if word != '.' ]
+        wfreq = {}
+        for word in words:
+            if word not in hw3.SW:
+                wfreq[word] = wfreq.get(word, 0) + 1
+        assert speech.text == expected, filename
+        assert speech.sentences == [ s.strip() for s in expected.split('.') if s != '' ], filename
+        assert speech.words == words, filename
+        assert list(speech.wfreq.items()) == list(wfreq.items()), filename
+        # The streaming tokenizer must agree whatever the chunk size.
+        for size in (7, 64, 4096):
+            with open(filename, 'r') as infile:
+                assert list(hw3.tokenize(infile, size)) == words, (filename, size)
+        lean = hw3.Speech(filename, lean=True)
+        assert lean.wfreq == speech.wfreq and lean.length == speech.length, filename
+    print("tokenizer: normalize() and tokenize() match the legacy pipeline on {} files".format(len(texts)))
+    tokens = sum([ len(text.split()) for text in texts ])
+    for label, fn in (('legacy', legacyNormalize), ('normalize', hw3.normalize)):
+        elapsed = best(lambda: [ fn(text) for text in texts ])
+        print("tokenizer: {:>10} {:8.3f}s {:12.0f} tokens/s".format(label, elapsed, tokens/elapsed))
+
+# Load the functions and tables of corpus/parse.py. The module builds
+# its vectors and identifies the unknowns as soon as it is imported,
+# so only its imports, functions and constant tables are run.
+def legacyParse(filename="corpus/parse.py"):
+    import ast
+    with open(filename, 'r') as infile:
+        tree = ast.parse(infile.read())
+    body = [ node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+             or (isinstance(node, ast.Assign) and not isinstance(node.value, ast.Call)) ]
+    namespace = {}
+    exec(compile(ast.Module(body=body, type_ignores=[]), filename, 'exec'), namespace)
+    return(namespace)
+
+# Check the stemmed tokenizer (Speech(stemmed=True)) against
+# parse.parseFile() over every file in the corpus, then compare their
+# throughput with that of the same pipeline without contractions or
+# stemming ("split"), and of the plain tokenizer. Rates are in
+# parseFile() tokens per second.
+def benchStem():
+    parse = legacyParse()
+    files = corpusFiles()
+    for filename in files:
+        length, wfreq = parse['parseFile'](filename, {})
+        speech = hw3.Speech(filename, lean=True, stemmed=True)
+        assert length == speech.length and list(wfreq.items()) == list(speech.wfreq.items()), filename
+        for size in (7, 64, 4096):
+            with open(filename, 'r') as infile:
+                assert sum(1 for word in hw3.stemTokenize(infile, size)) == length, (filename, size)
+    print("stem: stemmed Speech matches parse.parseFile() on {} files".format(len(files)))
+    tokens = sum([ parse['parseFile'](filename, {})[0] for filename in files ])
+    def legacy():
+        C = {}
+        for filename in files:
+            parse['parseFile'](filename, C)
+    def stemmed():
+        hw3.stem.cache_clear()
+        hw3.expandRun.cache_clear()
+        for filename in files:
+            hw3.Speech(filename, lean=True, stemmed=True)
+    def split():
+        for filename in files:
+            with open(filename, 'r') as infile:
+                words = [ word.strip('".,:;!?()') for word in infile.read().lower().split() ]
+            hw3.Speech.restore(filename, None, None, None, 0).count([ word for word in words if word not in hw3.SW ], ())
+    def plain():
+        for filename in files:
+            hw3.Speech(filename, lean=True)
+    for label, fn in (('parseFile', legacy), ('stemmed', stemmed), ('split', split), ('plain', plain)):
+        elapsed = best(fn)
+        print("stem: {:>10} {:8.3f}s {:12.0f} tokens/s".format(label, elapsed, tokens/elapsed))
+    print("stem: {}".format(hw3.stem.cache_info()))
+
+# Compare the memory held by full and lean Speech objects for the
+# whole corpus, as measured by tracemalloc.
+def benchSpeechMemory():
+    import tracemalloc
+    for lean in (False, True):
+        tracemalloc.start()
+        speeches = [ hw3.Speech(filename, lean) for filename in corpusFiles() ]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("speechmemory: lean={:<5} {:8.0f} KiB/speech".format(str(lean), size/len(speeches)/1024))
+
+# Reference copy of the original selection-sort Corpus.topK().
+def legacyTopK(corpus, k):
+    L = [ (word, corpus.wfreq[word]) for word in corpus.wfreq.keys() if corpus.dfreq[word] != len(corpus.speeches) ]
+    for i in range(k):
+        j = i + L[i:].index(max(L[i:], key=lambda x: x[1]))
+        L[i],L[j] = L[j],L[i]
+    return([ record[0] for record in L[:k] ])
+
+# Build a Corpus with a synthetic Zipf-like vocabulary of V words
+# spread over N pseudo-documents, without reading any files.
+def syntheticCorpus(V, N=100, ranked=False, seed=0):
+    import random
+    rng = random.Random(seed)
+    words = [ "w{}".format(i) for i in range(V) ]
+    tables = {}
+    for n in range(N):
+        tables[n] = { word:1 + int(1000/(1 + int(word[1:]))) for word in rng.sample(words, min(V, 2000)) }
+    return(addTables(hw3.Corpus(ranked=ranked), tables))
+
+# Compare the original selection-sort topK() against the partition and
+# maintained-ranking versions at several vocabulary sizes. The
+# legacy version is skipped where it would take minutes. All must
+# pick the same words in the same order, ties included (see
+# Corpus().topIds()): this is checked on the real corpus, where most
+# counts are tied, and on the synthetic ones where the legacy version
+# runs. identify() on the real corpus is also checked against the
+# original topK(), makeVector() and cosSimilarity().
+def benchTopK(k=2000):
+    names = speechNames()
+    for ranked in (False, True):
+        corpus = hw3.Corpus(ranked=ranked)
+        corpus.addSpeeches(names, workers=1)
+        N = len(corpus.speeches)
+        for size in (500, 1000, 2000):
+            template = legacyTopK(corpus, size)
+            assert corpus.topK(size) == template
+            corpus.createVectors(size)
+            speeches = { name:hw3.Speech.restore(None, None, None, speech.wfreq, speech.length) for (name, speech) in corpus.speeches.items() }
+            for speech in speeches.values():
+                speech.makeVector(template, corpus.dfreq, N)
+            for name in ('obama2', 'bush1', 'lincoln3', 'adams0'):
+                mystery = speeches[name]
+                legacy = sorted([ (speeches[other].cosSimilarity(mystery), other) for other in speeches ], reverse=True)[:6]
+                matches = corpus.search([ mystery ], 6)[0]
+                assert [ other for (score, other) in matches ] == [ other for (score, other) in legacy ]
+                assert np.allclose([ score for (score, other) in matches ], [ score for (score, other) in legacy ], atol=1e-5)
+    print("topK: topK() and identify() match the original on the corpus")
+    for V in (5000, 20000, 100000):
+        heap = syntheticCorpus(V)
+        ranked = syntheticCorpus(V, ranked=True)
+        assert heap.topK(k) == ranked.topK(k)
+        row = [ "topK: V={:<7} k={}".format(V, k) ]
+        if V <= 20000:
+            assert heap.topK(k) == legacyTopK(heap, k)
+            row.append("legacy {:8.4f}s".format(best(legacyTopK, heap, k, repeat=1)))
+        row.append("partition {:8.4f}s".format(best(heap.topK, k)))
+        row.append("ranked {:8.4f}s".format(best(ranked.topK, k)))
+        print(' '.join(row))
+
+# Build a Corpus of N synthetic documents of the given length, each
+# drawn from one of a number of "authors" with their own Zipf-like
+# preferences over a vocabulary of V words, along with Q queries
+# drawn the same way. Unlike syntheticCorpus(), nearest neighbours
+# here are meaningful.
+def authorCorpus(N, Q, authors=2000, V=20000, length=300, seed=0):
+    rng = np.random.default_rng(seed)
+    ranks = 1.0/np.arange(1, V+1)
+    preferences = [ rng.permutation(V) for a in range(authors) ]
+    def document(a):
+        words, counts = np.unique(preferences[a][rng.choice(V, size=length, p=ranks/ranks.sum())], return_counts=True)
+        return({ "w{}".format(w):int(c) for (w, c) in zip(words, counts) })
+    corpus = addTables(hw3.Corpus(), { "a{}_{}".format(n % authors, n):document(n % authors) for n in range(N) })
+    return(corpus, [ hw3.Speech.restore(None, None, None, document(q % authors), length) for q in range(Q) ])
+
+# Compare approximate (HyperplaneIndex) search against the exact scan:
+# recall@j (the fraction of the exact top j found) and mean query
+# latency, over a range of index settings.
+def benchAnn(N=20000, Q=200, k=2000, j=10):
+    corpus, queries = authorCorpus(N, Q)
+    corpus.createVectors(k)
+    start = time.perf_counter()
+    exact = corpus.search(queries, j)
+    elapsed = time.perf_counter() - start
+    print("ann: N={} k={} j={} exact {:8.3f} ms/query".format(N, k, j, 1000*elapsed/Q))
+    for tables, bits, probes in ((4, 16, 0), (8, 16, 1), (8, 12, 1), (16, 12, 2)):
+        corpus.approximate(tables, bits, probes)
+        corpus.search(queries[:1], j)
+        start = time.perf_counter()
+        approximate = corpus.search(queries, j)
+        elapsed = time.perf_counter() - start
+        # Queries with fewer than j rows shortlisted fall back to the
+        # exhaustive scan (see Corpus().search()), so recall is only
+        # measured over the others.
+        sizes = np.array([ len(rows) for rows in corpus.ann.candidates(corpus.vectors(queries)) ])
+        approximated = np.flatnonzero(sizes >= j)
+        recall = np.mean([ len({ n for (s, n) in approximate[q] } & { n for (s, n) in exact[q] })/len(exact[q]) for q in approximated ]) if len(approximated) else float('nan')
+        print("ann: tables={:<2} bits={:<2} probes={} recall@{} {:.3f} fallback {:.2f} median shortlist {:6.0f} {:8.3f} ms/query".format(
+            tables, bits, probes, j, recall, 1 - len(approximated)/Q, np.median(sizes), 1000*elapsed/Q))
+    corpus.approximate(0)
+
+# Apply random sequences of addSpeech() and removeSpeech() to a Corpus
+# of the real speeches, identifying as it goes so that its vectors are
+# updated in place (see refresh() and retemplate()), and check that the
+# final matches are those after a full createVectors() rebuild, for
+# several k, with and without the maintained ranking. For k=None, they
+# must also match a Corpus built afresh from the same speeches; for
+# other k, a fresh Corpus numbers the words in another order, and so
+# can break ties at the k-th count differently (see selectTop()).
+def benchIncremental(rounds=3, steps=40, j=5):
+    import random
+    names = speechNames()
+    queries = [ 'bush2', 'adams1', 'lincoln3', 'obama2', 'unknown1' ]
+    for ranked in (False, True):
+        for k in (30, 500, None):
+            start = time.perf_counter()
+            for seed in range(rounds):
+                rng = random.Random(seed)
+                order = list(names)
+                rng.shuffle(order)
+                present, absent = order[:60], order[60:]
+                corpus = hw3.Corpus(ranked=ranked)
+                corpus.addSpeeches(present, workers=1)
+                corpus.identifyMany(queries, k, j, workers=1)
+                for step in range(steps):
+                    if absent and (rng.random() < 0.6 or len(present) < 5):
+                        name = absent.pop(rng.randrange(len(absent)))
+                        corpus.addSpeech(name, lean=True)
+                        present.append(name)
+                    else:
+                        name = present.pop(rng.randrange(len(present)))
+                        corpus.removeSpeech(name)
+                        absent.append(name)
+                    if step % 7 == 0:
+                        corpus.identifyMany(queries, k, j, workers=1)
+                matches = corpus.identifyMany(queries, k, j, workers=1)
+                corpus.createVectors(k)
+                expected = [ corpus.identifyMany(queries, k, j, workers=1) ]
+                if k is None:
+                    fresh = hw3.Corpus(ranked=ranked)
+                    fresh.addSpeeches(list(corpus.speeches), workers=1)
+                    expected.append(fresh.identifyMany(queries, k, j, workers=1))
+                for results in expected:
+                    for found, wanted in zip(matches, results):
+                        assert [ name for (score, name) in found ] == [ name for (score, name) in wanted ]
+                        assert np.allclose([ score for (score, name) in found ], [ score for (score, name) in wanted ])
+            print("incremental: ranked={:<5} k={:<4} {} rounds of {} steps match rebuilds ({:.2f}s)".format(
+                str(ranked), str(k), rounds, steps, time.perf_counter() - start))
+
+# Time identifyMany() over the corpus for queries alternating between
+# two values of k, with and without the Corpus vector cache, checking
+# that the cache returns the same matches.
+def benchCache(ks=(500, 2000), rounds=10):
+    names = speechNames()
+    results = []
+    for entries in (0, 4):
+        corpus = hw3.Corpus()
+        corpus.cache = hw3.VectorCache(entries)
+        corpus.addSpeeches(names, workers=1)
+        start = time.perf_counter()
+        results.append([ corpus.identifyMany(hw3.U, k, 4, workers=1) for i in range(rounds) for k in ks ])
+        elapsed = time.perf_counter() - start
+        print("cache: entries={} k={} {:8.3f} s {}".format(entries, '/'.join(map(str, ks)), elapsed, corpus.cache.stats()))
+    assert results[0] == results[1]
+
+# Measure the latency of identify requests to a Server (see server.py)
+# on a Unix socket, from a number of concurrent clients each sending
+# requests one after another, checking the answers against
+# identifyMany(). The last run adds a client sending ~1 MB texts,
+# each different, to show that parsing them holds up the others only
+# briefly.
+def benchServer(clients=8, requests=50, k=2000, j=4):
+    import asyncio
+    import tempfile
+    import server
+    corpus = hw3.Corpus()
+    corpus.addSpeeches(speechNames())
+    expected = { u:[ list(m) for m in matches ] for (u, matches) in zip(hw3.U, corpus.identifyMany(hw3.U, k, j)) }
+    with open("{}{}.txt".format(corpus.directory, hw3.U[0]), 'r') as infile:
+        text = infile.read()
+    large = ''
+    for filename in corpusFiles():
+        with open(filename, 'r') as infile:
+            large += infile.read() + '\n'
+        if len(large) > 1<<20:
+            break
+    async def bulk(path, done):
+        connection = await server.connect(path)
+        i = 0
+        while not done.is_set():
+            response = await server.ask(connection, { 'text':large + " request{}.".format(i) })
+            assert 'matches' in response, response
+            i += 1
+        connection[1].close()
+        await connection[1].wait_closed()
+    async def client(path, n, latencies):
+        connection = await server.connect(path)
+        for i in range(requests):
+            u = hw3.U[(n + i) % len(hw3.U)]
+            request = { 'text':text } if i % 5 == 4 else { 'name':u }
+            start = time.perf_counter()
+            response = await server.ask(connection, request)
+            latencies.append(time.perf_counter() - start)
+            assert response['matches'] == expected[hw3.U[0] if 'text' in request else u], response
+        connection[1].close()
+    async def run(path):
+        latencies = []
+        for window, large in ((0.0, False), (0.001, False), (0.001, True)):
+            s = server.Server(corpus, k, j, window)
+            listener = await s.start(path)
+            latencies.clear()
+            done = asyncio.Event()
+            background = asyncio.ensure_future(bulk(path, done)) if large else None
+            start = time.perf_counter()
+            await asyncio.gather(*[ client(path, n, latencies) for n in range(clients) ])
+            elapsed = time.perf_counter() - start
+            if background is not None:
+                done.set()
+                await background
+            listener.close()
+            await listener.wait_closed()
+            s.close()
+            # Let the server see the clients hang up.
+            await asyncio.sleep(0.01)
+            p50, p99 = np.percentile(latencies, [50, 99])*1000
+            print("server: clients={}{} window={:.1f}ms {:6.0f} requests/s p50 {:6.2f} ms p99 {:6.2f} ms ({:.1f} requests/batch)".format(
+                clients, "+1MB" if large else "", window*1000, len(latencies)/elapsed, p50, p99, s.requests/s.batches))
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(os.path.join(directory, 'hw3.sock')))
+
+# Compare the time taken to build a Corpus and identify the unknown
+# speeches at several k with instrumentation off and on, and show
+# what the instrumentation recorded.
+def benchInstrument(rounds=5):
+    names = speechNames()
+    def run(corpus):
+        corpus.addSpeeches(names, workers=1)
+        for k in (500, 2000, 500, None):
+            corpus.identifyMany(hw3.U, k, 4, workers=1)
+    for enabled in (False, True, False, True):
+        def fresh():
+            corpus = hw3.Corpus()
+            corpus.instrument(enabled)
+            run(corpus)
+            return(corpus)
+        print("instrument: enabled={:<5} {:8.4f}s".format(str(enabled), best(fresh, repeat=rounds)))
+    corpus = hw3.Corpus()
+    events = []
+    corpus.instrument(callback=events.append)
+    run(corpus)
+    metrics = corpus.metrics()
+    for name, stage in metrics['stages'].items():
+        print("instrument: {:<14} {:4} calls {:8.4f}s wall {:8.4f}s cpu".format(name, stage['calls'], stage['wall'], stage['cpu']))
+    print("instrument: counters {} events {}".format(metrics['counters'], metrics['events']))
+    print("instrument: {} callback records, vocabulary {} cache {}".format(len(events), metrics['vocabulary'], metrics['cache']))
+    # Loading an index is recorded when the Corpus is made
+    # instrumented, including the re-parse of a changed speech; the
+    # words of a lean speech are re-read from its file.
+    import shutil
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        directory += '/'
+        for filename in corpusFiles():
+            shutil.copy(filename, directory)
+        index = directory + 'corpus.idx'
+        corpus = hw3.Corpus(directory)
+        corpus.addSpeeches(names, workers=1)
+        corpus.save(index)
+        with open(directory + names[0] + '.txt', 'a') as outfile:
+            outfile.write(" Appended.")
+        loaded = hw3.Corpus(directory, index, instrument=True)
+        assert loaded.metrics()['stages']['load']['calls'] == 1
+        assert loaded.metrics()['events'] == { 'reparse':1 }
+        for name in names[1:3]:
+            loaded.speeches[name].words
+        metrics = loaded.metrics()
+        assert metrics['counters']['rereads'] == 2
+        assert metrics['counters']['rereadBytes'] == sum([ os.path.getsize(directory + name + '.txt') for name in names[1:3] ])
+        print("instrument: load {:8.4f}s wall, counters {} events {}".format(metrics['stages']['load']['wall'], metrics['counters'], metrics['events']))
+
+# Compare two-stage author search (searchAuthors()) against the exact
+# scan on a synthetic corpus with several speeches per author: recall@j
+# of the speech ranking, how often the true author ranks first, the
+# number of rows scored per query, and the mean query latency.
+def benchAuthors(N=20000, Q=200, k=2000, j=10, authors=2000):
+    corpus, queries = authorCorpus(N, Q, authors)
+    corpus.createVectors(k)
+    start = time.perf_counter()
+    exact = corpus.search(queries, j)
+    elapsed = time.perf_counter() - start
+    print("authors: N={} authors={} k={} j={} exact {:8.3f} ms/query, {} rows/query".format(N, authors, k, j, 1000*elapsed/Q, N))
+    corpus.searchAuthors(queries[:1], j)
+    for top in (1, 3, 10):
+        start = time.perf_counter()
+        results = corpus.searchAuthors(queries, j, top)
+        elapsed = time.perf_counter() - start
+        recall = np.mean([ len({ n for (s, n) in r } & { n for (s, n) in e })/len(e) for ((a, r), e) in zip(results, exact) ])
+        first = np.mean([ a[0][1] == "a{}".format(q % authors) for (q, (a, r)) in enumerate(results) ])
+        print("authors: top {:>2} authors recall@{} {:.3f} author@1 {:.3f} {:8.3f} ms/query, {:.0f} rows/query".format(
+            top, j, recall, first, 1000*elapsed/Q, len(corpus.authorIndex.authors) + top*N/authors))
+
+# Memory figures for this process from /proc/self/smaps_rollup (Linux
+# only), in MB.
+def smaps():
+    figures = {}
+    with open('/proc/self/smaps_rollup', 'r') as infile:
+        for line in infile:
+            if line.split(':')[0] in ('Rss', 'Pss', 'Shared_Clean'):
+                figures[line.split(':')[0]] = int(line.split()[1])/1024
+    return(figures)
+
+# The peak resident memory of this process, in bytes. On Linux this is
+# VmHWM from /proc/self/status, which starts afresh when a process is
+# spawned; ru_maxrss (the fallback elsewhere) carries over the peak of
+# the process it was forked from, even across exec.
+def peakMemory():
+    import resource
+    try:
+        with open('/proc/self/status', 'r') as infile:
+            for line in infile:
+                if line.startswith('VmHWM:'):
+                    return(int(line.split()[1])*1024)
+    except OSError:
+        pass
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024)
+
+# Open a VectorStore in a worker process and answer the queries from
+# it, returning the matches, the time taken to open the store, and the
+# memory figures of the worker.
+def storeWorker(filename, queries, j):
+    start = time.perf_counter()
+    store = hw3.VectorStore(filename)
+    opened = time.perf_counter() - start
+    matches = store.search(queries, j)
+    return(matches, opened, smaps())
+
+# Export a synthetic corpus to a VectorStore, then answer the same
+# queries from several worker processes, each mapping the store,
+# checking the answers against the Corpus and showing how much of
+# each worker's memory is shared.
+def benchStore(N=5000, Q=50, k=2000, j=10, workers=4):
+    import tempfile
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    corpus, queries = authorCorpus(N, Q)
+    corpus.createVectors(k)
+    expected = corpus.search(queries, j)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'corpus.vec')
+        start = time.perf_counter()
+        corpus.export(filename)
+        print("store: N={} k={} exported {:.0f} MB in {:.3f}s".format(N, k, os.path.getsize(filename)/1e6, time.perf_counter() - start))
+        # Spawn rather than fork the workers, so they start out sharing
+        # nothing with this process.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for matches, opened, memory in pool.map(storeWorker, [ filename ]*workers, [ queries ]*workers, [ j ]*workers):
+                assert [ [ n for (s, n) in m ] for m in matches ] == [ [ n for (s, n) in m ] for m in expected ]
+                print("store: worker opened in {:.4f}s, rss {:.0f} MB pss {:.0f} MB shared {:.0f} MB".format(
+                    opened, memory['Rss'], memory['Pss'], memory['Shared_Clean']))
+
+# Write a synthetic corpus scale times the size of the real one into
+# directory: speech s<i> is made by resampling (with replacement, so
+# also shuffling) the words of the i-th real speech, modulo the number
+# of real speeches. The unknown speeches are copied over unchanged.
+# Returns the names of the synthetic speeches.
+def scaleCorpus(directory, scale, seed=0):
+    rng = np.random.default_rng(seed)
+    sources = []
+    for filename in corpusFiles():
+        with open(filename, 'r') as infile:
+            sources.append(infile.read().split())
+        if os.path.basename(filename)[:-4] in hw3.U:
+            with open(os.path.join(directory, os.path.basename(filename)), 'w') as outfile:
+                outfile.write(' '.join(sources.pop()))
+    names = [ "s{}".format(i) for i in range(scale*len(sources)) ]
+    for i, name in enumerate(names):
+        words = sources[i % len(sources)]
+        with open(os.path.join(directory, name + '.txt'), 'w') as outfile:
+            outfile.write(' '.join([ words[n] for n in rng.integers(len(words), size=len(words)) ]))
+    return(names)
+
+# Time each stage of the pipeline over a synthetic corpus of the given
+# scale (see scaleCorpus()): parsing the speeches (Speech()), adding
+# them to a Corpus (updateFreqs()), topK(), createVectors() and
+# identify() for each unknown speech. Run in a freshly spawned (not
+# forked) process by benchScale(), so that the peak resident memory is
+# for this scale alone: a forked child would start out with the
+# parent's resident pages, and so with whatever earlier benchmarks
+# left behind (see also peakMemory()).
+def scaleStages(scale, k, j, seed):
+    import tempfile
+    result = { 'scale':scale, 'k':k, 'j':j }
+    with tempfile.TemporaryDirectory() as directory:
+        directory += '/'
+        names = scaleCorpus(directory, scale, seed)
+        result['speeches'] = len(names)
+        result['bytes'] = sum([ os.path.getsize(directory + name + '.txt') for name in names ])
+        corpus = hw3.Corpus(directory)
+        stages = {}
+        start = time.perf_counter()
+        speeches = [ hw3.Speech(directory + name + '.txt', lean=True) for name in names ]
+        stages['Speech'] = time.perf_counter() - start
+        result['tokens'] = sum([ speech.length for speech in speeches ])
+        start = time.perf_counter()
+        for name, speech in zip(names, speeches):
+            corpus.speeches[name] = speech
+            corpus.updateFreqs(speech)
+        stages['updateFreqs'] = time.perf_counter() - start
+        result['vocabulary'] = len(corpus.vocabulary)
+        stages['topK'] = best(corpus.topK, k)
+        stages['createVectors'] = best(corpus.createVectors, k, repeat=1)
+        start = time.perf_counter()
+        for u in hw3.U:
+            corpus.identify(u, k, j)
+        stages['identify'] = (time.perf_counter() - start)/len(hw3.U)
+        result['seconds'] = stages
+    result['maxrss'] = peakMemory()
+    return(result)
+
+# Time the pipeline stages over synthetic corpora at several scales
+# (see scaleStages()), each in its own spawned process, and write the results,
+# along with the commit and versions they were measured at, as JSON to
+# output, for comparison across commits. 1000x needs several GB of
+# disk and a long while; run it with, e.g.,
+#
+#   python bench.py scale=10,100,1000
+def benchScale(*scales, k=2000, j=4, seed=0, output="bench_scale.json"):
+    import json
+    import platform
+    import subprocess
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = { 'commit':commit, 'time':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':platform.python_version(),
+               'numpy':np.__version__, 'results':[] }
+    for scale in scales or (10, 100):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = pool.submit(scaleStages, scale, k, j, seed).result()
+        report['results'].append(result)
+        print("scale: {:>5}x {:7} speeches {:7.0f} MB ".format(scale, result['speeches'], result['bytes']/1e6)
+              + ' '.join([ "{} {:.4f}s".format(stage, seconds) for (stage, seconds) in result['seconds'].items() ])
+              + " peak {:.0f} MB".format(result['maxrss']/1e6))
+    with open(output, 'w') as outfile:
+        json.dump(report, outfile, indent=1)
+    print("scale: results written to {}".format(output))
+
+# Build a HashedCorpus of the real corpus (unigrams only, stemmed, so
+# that it can be checked against the exact sparse Corpus), check that
+# building it in two halves and merging gives the same document
+# frequencies and matches, and compare the matches for each speech with
+# the Corpus, for a few widths.
+def benchHashing(j=4):
+    names = speechNames()
+    corpus = hw3.Corpus(stemmed=True)
+    corpus.addSpeeches(names)
+    corpus.useVectors(None)
+    exact = corpus.search([ hw3.Speech("corpus/{}.txt".format(name), lean=True, stemmed=True) for name in names ], j)
+    print("hashing: exact vocabulary {} words".format(corpus.matrix.shape[1]))
+    for width in (1<<12, 1<<16, 1<<20):
+        hashed = hw3.HashedCorpus(width=width, bigrams=False, stemmed=True)
+        start = time.perf_counter()
+        hashed.addSpeeches(names, workers=1)
+        elapsed = time.perf_counter() - start
+        results = hashed.identifyMany(names, j, workers=1)
+        assert hashed.identifyMany([], j) == []
+        overlap = np.mean([ len({ n for (s, n) in r } & { n for (s, n) in e })/j for (r, e) in zip(results, exact) ])
+        print("hashing: width 2^{:<2} df {:5.0f} KB build {:.3f}s overlap@{} {:.3f}".format(
+            width.bit_length() - 1, hashed.dfreq.nbytes/1024, elapsed, j, overlap))
+    half = len(names)//2
+    merged = hw3.HashedCorpus(chars=3)
+    merged.addSpeeches(names[:half])
+    other = hw3.HashedCorpus(chars=3)
+    other.addSpeeches(names[half:])
+    merged.merge(other)
+    whole = hw3.HashedCorpus(chars=3)
+    whole.addSpeeches(names, workers=1)
+    assert merged.names == whole.names and (merged.dfreq == whole.dfreq).all()
+    assert merged.identifyMany(names[:8], j) == whole.identifyMany(names[:8], j)
+    print("hashing: merged halves match the whole corpus ({} speeches, bigrams and char 3-grams)".format(len(names)))
+
+# Pack the corpus speeches into a .tar.gz, a .zip and a .jsonl.gz
+# archive, then time adding them to a Corpus straight from each archive
+# (with one worker and with several) against adding the files one by
+# one, checking that every way gives the same word frequencies.
+def benchArchive(workers=4):
+    import gzip
+    import json
+    import tarfile
+    import zipfile
+    import tempfile
+    names = speechNames()
+    start = time.perf_counter()
+    corpus = hw3.Corpus()
+    corpus.addSpeeches(names, workers=1)
+    print("archive: {:>10} {:2} worker(s) {:.3f}s".format('files', 1, time.perf_counter() - start))
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [ os.path.join(directory, "speeches" + extension) for extension in ('.tar.gz', '[2024].zip', '.jsonl.gz') ]
+        with tarfile.open(sources[0], 'w:gz') as archive:
+            for name in names:
+                archive.add("corpus/{}.txt".format(name), arcname="speeches/{}.txt".format(name))
+        with zipfile.ZipFile(sources[1], 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in names:
+                archive.write("corpus/{}.txt".format(name), "speeches/{}.txt".format(name))
+        with gzip.open(sources[2], 'wt', encoding='utf-8') as outfile:
+            for name in names:
+                with open("corpus/{}.txt".format(name), 'r') as infile:
+                    outfile.write(json.dumps({ 'name':name, 'text':infile.read() }) + '\n')
+        for source in sources:
+            for n in (1, workers):
+                start = time.perf_counter()
+                archived = hw3.Corpus()
+                added = archived.addArchive(source, workers=n)
+                elapsed = time.perf_counter() - start
+                assert added == names
+                assert all([ archived.speeches[name].wfreq == corpus.speeches[name].wfreq for name in names ])
+                print("archive: {:>10} {:2} worker(s) {:.3f}s".format(source.split('speeches')[-1], n, elapsed))
+
+# Run the benchmarks named on the command line (or all of them), e.g.
+# "tokenizer" or, to pass arguments, "scale=10,100".
+if __name__ == '__main__':
+    benchmarks = { name[5:].lower():fn for (name, fn) in globals().items() if name.startswith('bench') }
+    for arg in sys.argv[1:] or benchmarks:
+        name, sep, args = arg.partition('=')
+        benchmarks[name.lower()](*[ int(a) for a in args.split(',') if a ])
@@ -1,5 +1,24 @@
+import io
+import os
 import re
+import glob
+import gzip
+import json
+import mmap
+import time
+import tarfile
+import zipfile
+import zlib
+import heapq
+import hashlib
 from math import log, sqrt
+from fnmatch import fnmatch
+from functools import lru_cache, partial
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 # Presidents
 P = ( 'adams','arthur','bharrison','buchanan','bush','carter','cleveland', 
@@ -29,53 +48,680 @@ REGEXP=((r"\'s", ""), (r"won\'t", "will not"), (r"can\'t", "can not"),
         (r"n\'t", " not"), (r"\'re", " are"), (r"\'d", " would"), (r"\'ll", " will"), 
         (r"\'t", " not"), (r"\'ve", " have"), (r"\'m", " am"))
 
+# Precompiled forms of REGEXP: the individual patterns, applied in
+# order, and a single alternation of all of them together with a
+# table giving the replacement for each matched contraction.
+EXPANSIONS=tuple( (re.compile(pattern), repl) for (pattern, repl) in REGEXP )
+CONTRACTION=re.compile('|'.join([ pattern for (pattern, repl) in REGEXP ]))
+CONTRACTIONS={ pattern.replace("\\'", "'"):repl for (pattern, repl) in REGEXP }
+
+# Translation table for punctuation: dashes and underscores become
+# spaces, ? and ! become . (the uniform EOS mark), and the remaining
+# marks, including any "'" left over after expansion, are dropped.
+MARKS=str.maketrans({ '-':' ', '—':' ', '_':' ', '(':None, ')':None, ',':None,
+                      ':':None, "'":None, '"':None, '?':'.', '!':'.' })
+
+# expandWord(word) expands contractions and flushes possessives in a
+# single word, with the goal of eliminating all of the embedded "'"
+# characters. A word with a single "'" can match at most one REGEXP
+# entry, so one pass of the combined CONTRACTION pattern suffices;
+# otherwise, the REGEXP substitutions are applied in order, since an
+# earlier one can expose a match for a later one.
+def expandWord(word):
+    if word.count("'") == 1:
+        return(CONTRACTION.sub(lambda m: CONTRACTIONS[m.group()], word))
+    for (pattern, repl) in EXPANSIONS:
+        if "'" not in word:
+            break
+        word = pattern.sub(repl, word)
+    return(word)
+
+# normalize(text) produces the simplified text of a speech: words
+# are expanded (see expandWord()) and run together, then ellipses
+# are dropped, other punctuation is mapped through MARKS, and runs
+# of whitespace are collapsed to a single space. Case is unchanged.
+#
+# Note: ellipses must be dropped before MARKS is applied, so that a
+# ? or ! translated into . cannot form a new "...".
+def normalize(text):
+    text = ''.join([ word if "'" not in word else expandWord(word) for word in text.split() ])
+    return(' '.join(text.replace('...', '').translate(MARKS).split()))
+
+# tokenize(infile, size) is a generator that reads a speech from the
+# open file infile in chunks of size characters, yielding the same
+# lower-case words as Speech().words would contain, without ever
+# holding the whole text. Each step of normalize() works across chunk
+# boundaries by holding back what the next chunk could still change:
+# a partial whitespace-delimited token, a trailing run of periods
+# (which might yet be part of an ellipsis), and a partial word.
+def tokenize(infile, size=1<<20):
+    carry = ''
+    dots = ''
+    partial = ''
+    while True:
+        chunk = infile.read(size)
+        text = carry + chunk
+        tokens = text.split()
+        carry = ''
+        if chunk and tokens and not text[-1].isspace():
+            carry = tokens.pop()
+        joined = dots + ''.join([ word if "'" not in word else expandWord(word) for word in tokens ])
+        dots = ''
+        if chunk:
+            stripped = joined.rstrip('.')
+            dots = joined[len(stripped):]
+            joined = stripped
+        text = partial + joined.replace('...', '').translate(MARKS)
+        words = text.split()
+        partial = ''
+        if chunk and words and not text[-1].isspace():
+            partial = words.pop()
+        for word in words:
+            word = word.lower()
+            if word != '.':
+                yield(word.strip('.'))
+        if not chunk:
+            return
+
+# Contractions, as expanded by the stemmed tokenizer (from
+# corpus/parse.py, where each pair is replaced in turn, in this
+# order, in the lower-cased text; the pairs with upper case letters
+# can therefore never match).
+CC = ( ("aren't","are not"),("can't","can not"),
+       ("could've","could have"),("couldn't","could not"),
+       ("couldn't've","could not have"),("didn't","did not"),
+       ("doesn't","does not"),("don't","do not"),
+       ("hadn't","had not"),("hadn't've","had not have"),
+       ("hasn't","has not"),("haven't","have not"),
+       ("he'd","he had"),("he'd've","he would have"),
+       ("he'll","he will"),("he's","he is"),("how'd","how did"),
+       ("how'll","how will"),("how's","how has"),("I'd","I had"),
+       ("I'd've","I would have"),("I'll","I will"),
+       ("I'm","I am"),("I've","I have"),("isn't","is not"),
+       ("it'd","it had"),("it'd've","it would have"),
+       ("it'll","it will"),("it's","it is"),("let's","let us"),
+       ("ma'am","madam"),("mightn't","might not"),
+       ("mightn't've","might not have"),("might've","might have"),
+       ("mustn't","must not"),("must've","must have"),
+       ("needn't","need not"),("not've","not have"),
+       ("o'clock","of the clock"),("shan't","shall not"),
+       ("she'd","she had"),("she'd've","she would have"),
+       ("she'll","she will"),("she's","she is"),
+       ("should've","should have"),("shouldn't","should not"),
+       ("shouldn't've","should not have"),("that's","that is"),
+       ("there'd","there had"),("there'd've","there would have"),
+       ("there're","there are"),("there's","there is"),
+       ("they'd","they had"),("they'd've","they would have"),
+       ("they'll","they will"),("they're","they are"),
+       ("they've","they have"),("wasn't","was not"),
+       ("we'd","we had"),("we'd've","we would have"),
+       ("we'll","we will"),("we're","we are"),("we've","we have"),
+       ("weren't","were not"),("what'll","what will"),
+       ("what're","what are"),("what's","what is"),
+       ("what've","what have"),("when's","when is"),
+       ("where'd","where did"),("where's","where is"),
+       ("where've","where have"),("who'd","who had"),
+       ("who'll","who will"),("who're","who are"),
+       ("who's","who is"),("who've","who have"),
+       ("why'll","why will"),("why're","why are"),
+       ("why's","why is"),("won't","will not"),
+       ("would've","would have"),("wouldn't","would not"),
+       ("wouldn't've","would not have"),("y'all","you all"),
+       ("y'all'd've","you all would have"),
+       ("you'd","you had"),("you'd've","you would have"),
+       ("you'll","you will"),("you're","you are"),
+       ("you've","you have"),("-"," ") )
+
+# The CC pairs that can match lower-cased text. All of them contain a
+# "'" or a "-", and none contains a space, so replacing the pairs in
+# turn over the whole text is the same as doing so within each run of
+# non-space characters with a "'" or "-" in it (see expandRun()).
+CCLOWER=tuple( (x, y) for (x, y) in CC if x == x.lower() )
+
+# suffixTrie(endings) returns a trie of the reversed endings: following
+# the characters of a word from its end, the '' key of each node
+# reached gives the position in endings of the ending found there.
+def suffixTrie(endings):
+    trie = {}
+    for i, ending in enumerate(endings):
+        node = trie
+        for c in reversed(ending):
+            node = node.setdefault(c, {})
+        node[''] = i
+    return(trie)
+
+# Suffixes removed by the stemmer, in the order they are tried, and
+# their trie.
+ENDINGS=( 'able','al','ance','ant','ar','ary','ate','ement','ence','ent','er','ess',
+          'ible','ic','ify','ine','ion','ism','iti','ity','ive','ize','ly','ment',
+          'or','ou','ous','th','ure' )
+SUFFIXES=suffixTrie(ENDINGS)
+
+# expandRun(run) expands the contractions in a run of non-space
+# characters by replacing each of the CC pairs in turn, as in
+# corpus/parse.py. Runs repeat heavily, so the results are memoized.
+@lru_cache(maxsize=1<<14)
+def expandRun(run):
+    for x, y in CCLOWER:
+        run = run.replace(x, y)
+    return(run)
+
+# stem(word) is the simple suffix-stripping stemmer of corpus/parse.py:
+# plural endings are dropped, then each of ENDINGS is removed in turn
+# if the word (as shortened so far) ends with it. Rather than trying
+# all the endings, the suffix trie finds the first of the remaining
+# ones the word ends with. Words repeat heavily, so the results are
+# memoized (in a bounded LRU cache).
+@lru_cache(maxsize=1<<16)
+def stem(word):
+    if word[-3:] == 'ies' and word[-4:] not in ('eies', 'aies'):
+        word = word[:-3] + 'y'
+    if word[-2:] == 'es' and word[-3:] not in ('aes', 'ees', 'oes'):
+        word = word[:-1]
+    if word[-2:] == "'s":
+        word = word[:-2]
+    if word[-1:] == 's' and word[-2:] not in ('us', 'ss', 'ys'):
+        word = word[:-1]
+    i = 0
+    while True:
+        node = SUFFIXES
+        first = None
+        for c in reversed(word):
+            node = node.get(c)
+            if node is None:
+                break
+            j = node.get('')
+            if j is not None and j >= i and (first is None or j < first):
+                first = j
+        if first is None:
+            return(word)
+        word = word[:-len(ENDINGS[first])]
+        i = first + 1
+
+# stemTokenize(infile, size) is the tokenizer of corpus/parse.py, as
+# a generator over the stemmed, non-stop words of the file. The text is
+# lower-cased, contractions are expanded (see expandRun()), and each
+# word is stripped of surrounding punctuation, dropped if it is a stop
+# word, and stemmed. Note that, unlike tokenize(), stop words are
+# dropped before stemming. The file is read in chunks of the given
+# size, cut at the last space.
+def stemTokenize(infile, size=1<<20):
+    carry = ''
+    while True:
+        chunk = infile.read(size)
+        text = carry + chunk
+        carry = ''
+        if chunk:
+            cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'))
+            if cut < 0:
+                carry = text
+                continue
+            text, carry = text[:cut+1], text[cut+1:]
+        text = ' '.join([ run if "'" not in run and '-' not in run else expandRun(run) for run in text.lower().split() ])
+        words = [ word.strip('".,:;!?()') for word in text.split() ]
+        yield from map(stem, [ word for word in words if word not in SW ])
+        if not chunk:
+            return
+
+# Version tag for on-disk Corpus index files. Bump this whenever the
+# tokenizer or the index layout changes, so that older index files
+# are ignored rather than trusted.
+INDEXVERSION=7
+
+# Magic number and version for vector store files (see
+# Corpus().export() and VectorStore()).
+STOREMAGIC=b'HW3STORE'
+STOREVERSION=1
+
+# fileStamp(filename) returns the (mtime, size) pair used to decide
+# cheaply whether a speech file may have changed since it was parsed.
+def fileStamp(filename):
+    st = os.stat(filename)
+    return((st.st_mtime_ns, st.st_size))
+
+# fileDigest(filename) returns a content hash of the file, used to
+# confirm a file is unchanged when only its mtime has moved (e.g.,
+# after a fresh checkout or copy).
+def fileDigest(filename):
+    with open(filename, 'rb') as infile:
+        return(hashlib.sha1(infile.read()).hexdigest())
+
+# countSpeech(filename, stemmed) parses a speech and returns only what
+# a Corpus needs to account for it: the file stamp, the word frequency
+# distribution and the length. It is a module-level function so that
+# Corpus().addSpeeches() can run it in worker processes and ship back
+# these compact tables instead of whole Speech objects.
+def countSpeech(filename, stemmed=False):
+    speech = Speech(filename, lean=True, stemmed=stemmed)
+    return((speech.stamp, speech.wfreq, speech.length))
+
+# countSpeeches(filenames, workers, stemmed) applies countSpeech() to
+# each of the filenames, in a pool of worker processes (workers
+# defaults to the number of CPUs; with 1 worker, everything is done in
+# this process), returning the results in the same order as
+# filenames.
+def countSpeeches(filenames, workers=None, stemmed=False):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(filenames) <= 1:
+        return([ countSpeech(filename, stemmed) for filename in filenames ])
+    with ProcessPoolExecutor(max_workers=min(workers, len(filenames))) as pool:
+        return(list(pool.map(countSpeech, filenames, [ stemmed ]*len(filenames), chunksize=max(1, len(filenames)//(4*workers)))))
+
+# countText(text, stemmed) is countSpeech() for the text of a speech
+# rather than a file, returning only the word frequency distribution
+# and the length; Corpus().addArchive() runs it in worker processes.
+def countText(text, stemmed=False):
+    speech = Speech.fromText(text, stemmed)
+    return((speech.wfreq, speech.length))
+
+# speechName(path) returns the name of the speech in the file (or
+# archive member) at path: its base name without the extension.
+def speechName(path):
+    return(os.path.splitext(os.path.basename(path))[0])
+
+# readSpeeches(source, pattern, size) is a generator that yields a
+# (name, filename, infile) triple for each speech in source, where
+# infile is an open text stream of the speech, valid until the next
+# triple is asked for, and filename is the speech file (None if the
+# speech is inside an archive). Nothing is extracted to disk: archives
+# are read from disk through buffers of size bytes, and each speech is
+# decompressed as it is read, into another buffer of size bytes, so it
+# can be fed straight to tokenize(). The source may be
+#
+#   a directory, in which the files matching pattern are read;
+#   a glob, such as "corpus/*[0-3].txt";
+#   a .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz archive, whose members
+#     matching pattern are read in archive order, in one pass;
+#   a .zip archive, whose members matching pattern are read; or
+#   a .jsonl or .jsonl.gz file of {"name": ..., "text": ...} objects,
+#     one per line.
+#
+# A source that is an existing file is never taken as a glob, so an
+# archive may have '*?[' in its name (e.g., "speeches[2024].zip").
+# Archive members are decoded as UTF-8.
+def readSpeeches(source, pattern="*.txt", size=1<<20):
+    lower = source.lower()
+    literal = os.path.isfile(source) or not any([ c in source for c in '*?[' ])
+    if os.path.isdir(source) or not literal:
+        paths = glob.iglob(os.path.join(source, pattern)) if os.path.isdir(source) else glob.iglob(source)
+        for path in sorted(paths):
+            with open(path, 'r', buffering=size) as infile:
+                yield((speechName(path), path, infile))
+    elif lower.endswith(('.jsonl', '.jsonl.gz')):
+        opener = gzip.open if lower.endswith('.gz') else open
+        with opener(source, 'rt', encoding='utf-8') as lines:
+            for line in lines:
+                if line.strip():
+                    record = json.loads(line)
+                    yield((record['name'], None, io.StringIO(record['text'])))
+    elif lower.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+        # (tarfile ignores its own bufsize outside of stream mode, and
+        # the members of a stream can not be wrapped as text, so the
+        # buffering is done here.)
+        with open(source, 'rb', buffering=size) as raw, tarfile.open(fileobj=raw, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile() and fnmatch(os.path.basename(member.name), pattern):
+                    with io.TextIOWrapper(io.BufferedReader(archive.extractfile(member), size), encoding='utf-8') as infile:
+                        yield((speechName(member.name), None, infile))
+    elif lower.endswith('.zip'):
+        with open(source, 'rb', buffering=size) as raw, zipfile.ZipFile(raw) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and fnmatch(os.path.basename(member.filename), pattern):
+                    with io.TextIOWrapper(io.BufferedReader(archive.open(member), size), encoding='utf-8') as infile:
+                        yield((speechName(member.filename), None, infile))
+    else:
+        raise ValueError("unknown kind of speech source {!r}".format(source))
+
+# hashFeatures(words, width, bigrams, chars, stopwords, chunk) hashes
+# the features of a sequence of words, ignoring any of the given stop
+# words, into the range 0..width-1: each word, each pair of consecutive
+# words if bigrams is True, and, if chars is nonzero, each character
+# chars-gram of each word (marked off with < and >). Features are
+# hashed with CRC-32, which, unlike hash(), is the same in every
+# process. The words are consumed one at a time and each feature is
+# hashed as it is made; the hashes are folded into the counts every
+# chunk features, so memory is bounded by the number of distinct
+# columns, not by the length of the speech. Returns the distinct
+# hashes, in order, the number of features with each, and the number
+# of words (stop words included).
+def hashFeatures(words, width=1<<18, bigrams=True, chars=0, stopwords=(), chunk=1<<16):
+    counts = Counter()
+    hashes = []
+    length = 0
+    previous = None
+    for word in words:
+        length += 1
+        if word in stopwords:
+            continue
+        hashes.append(zlib.crc32(word.encode('utf-8')))
+        if bigrams and previous is not None:
+            hashes.append(zlib.crc32((previous + ' ' + word).encode('utf-8')))
+        previous = word
+        if chars:
+            padded = '<' + word + '>'
+            hashes.extend([ zlib.crc32(('#' + padded[i:i+chars]).encode('utf-8')) for i in range(len(padded) - chars + 1) ])
+        if len(hashes) >= chunk:
+            keys, found = np.unique(np.array(hashes, dtype=np.int64) % width, return_counts=True)
+            counts.update(dict(zip(keys.tolist(), found.tolist())))
+            hashes = []
+    keys, found = np.unique(np.array(hashes, dtype=np.int64) % width, return_counts=True)
+    counts.update(dict(zip(keys.tolist(), found.tolist())))
+    keys = np.array(sorted(counts), dtype=np.uint32)
+    return((keys, np.array([ counts[key] for key in keys.tolist() ], dtype=np.uint32), length))
+
+# hashSpeech(filename, width, bigrams, chars, stemmed) streams a speech
+# file through tokenize() (or stemTokenize(), if stemmed) straight into
+# hashFeatures(), and returns its file stamp, its hashed features and
+# its length. Like countSpeech(), it can be run in worker processes.
+def hashSpeech(filename, width=1<<18, bigrams=True, chars=0, stemmed=False):
+    stamp = fileStamp(filename)
+    with open(filename, 'r') as infile:
+        if stemmed:
+            keys, counts, length = hashFeatures(stemTokenize(infile), width, bigrams, chars)
+        else:
+            keys, counts, length = hashFeatures(tokenize(infile), width, bigrams, chars, SW)
+    return((stamp, keys, counts, length))
+
+# cosines(queries, matrix, norms) returns the matrix of cosine
+# similarities of each row of queries with each row of matrix, whose
+# row norms are given; both are dense arrays, or both SparseMatrix.
+def cosines(queries, matrix, norms):
+    if isinstance(queries, SparseMatrix):
+        products = queries.products(matrix)
+        qnorms = queries.rowNorms()
+    else:
+        products = queries @ matrix.T
+        qnorms = np.sqrt(np.einsum('ij,ij->i', queries, queries))
+    return(products / (np.outer(qnorms, norms) + 1e-6))
+
+# selectTop(heavy, counts, positions, k) returns the list of the (up
+# to) k word ids that the original selection sort in Corpus().topK()
+# would pick, in its order. That sort made k passes over a list of the
+# candidate words in order of id, each time swapping the first word
+# with the largest count in the rest of the list into the next place,
+# so that words tied at a count were picked in an order set by the
+# earlier swaps. Here, for each count, a heap holds the current places
+# of the words with that count: each step pops the first place of the
+# largest count, and moves the word it displaces to the vacated place,
+# as the swap did, in O(log V) rather than O(V) steps. Places are word
+# ids, which are in the same order as the list. Only the words that
+# can be picked need be in heavy (those with at least the k-th largest
+# count, in any order); positions is the ascending array of all the
+# candidate ids (or at least the first k of them) and counts is
+# indexed by word id.
+def selectTop(heavy, counts, positions, k):
+    heaps = {}
+    for i in sorted(heavy):
+        heaps.setdefault(int(counts[i]), []).append(i)
+    tops = sorted(heaps, reverse=True)
+    t = 0
+    # The word now at each place whose word has moved.
+    moved = {}
+    L = []
+    for place in positions[:min(k, len(heavy))].tolist():
+        while not heaps[tops[t]]:
+            t += 1
+        j = heapq.heappop(heaps[tops[t]])
+        L.append(moved.pop(j, j))
+        if j != place:
+            displaced = moved.pop(place, place)
+            moved[j] = displaced
+            heap = heaps.get(int(counts[displaced]))
+            if heap is not None:
+                heapq.heapreplace(heap, j)
+    return(L)
+
+# authorOf(name) returns the author of the named speech: the name
+# without its trailing number (and any separator before it), e.g.,
+# 'adams' for 'adams2'.
+def authorOf(name):
+    return(re.sub(r'[_-]?\d+$', '', str(name)))
+
 class Corpus():
-    def __init__(self, directory="corpus/"):
+    def __init__(self, directory="corpus/", index=None, ranked=False, stemmed=False, instrument=False, callback=None):
         # Directory where the speech text files are located.
         self.directory=directory
+        # Whether speeches are counted by their stemmed words (see
+        # Speech()).
+        self.stemmed=stemmed
+        # Optional filename of an on-disk index (see Corpus().save()).
+        # If the file exists, the Corpus is restored from it, and
+        # only the speeches whose files have changed are re-parsed. An
+        # index that can not be read, or was made for another
+        # directory or with(out) stemming, is ignored (see load()).
+        self.index=index
         # Dictionary of Speech objects indexed by speech name.
         self.speeches={}
+        # Vocabulary shared by the speeches in the Corpus: each word
+        # is stored once, and numbered by an integer id.
+        self.vocabulary=Vocabulary()
+        # Word and document counts over the Corpus, indexed by word id
+        # (with room to grow; see grow()).
+        self.wcounts=np.zeros(0, dtype=np.int64)
+        self.dcounts=np.zeros(0, dtype=np.int64)
         # Word frequency distribution (less stop words) for the Corpus
         # (will be computed from individual Speech wfreqs). Keys are
-        # words, values are word counts over the Corpus.
-        self.wfreq={}
+        # words, values are word counts over the Corpus. This is a
+        # read-only view of self.wcounts.
+        self.wfreq=FreqView(self, 'wcounts')
         # Document frequency distribution (less stop words).  Keys are
-        # words, values are document counts over the Corpus.
-        self.dfreq={}
+        # words, values are document counts over the Corpus. This is a
+        # read-only view of self.dcounts.
+        self.dfreq=FreqView(self, 'dcounts')
         # Vector template: ordered list of high frequency words used
-        # in identification.
+        # in identification, and their word ids.
         self.template=[]
+        self.templateIds=np.zeros(0, dtype=np.int64)
+        # Optional frequency ranking, maintained incrementally by
+        # updateFreqs() and discountFreqs() if ranked is True. Keys are
+        # word counts, values are (insertion ordered) dictionaries of
+        # the ids of the words with that count over the Corpus. This
+        # makes topK() nearly free, at a small cost for every word
+        # added.
+        self.ranking={} if ranked else None
+        # Document-term matrix built by createVectors(): one row of
+        # TF/IDF weights (columns ordered as in self.template) per
+        # speech, in the order given by self.names, along with the
+        # precomputed row norms. The Speech objects the rows were
+        # made from are kept in self.vectorized, and the unweighted
+        # term frequencies in self.tf, so that the matrix can be
+        # brought up to date (see refresh()) without starting over.
+        self.names=[]
+        self.vectorized=[]
+        self.tf=None
+        self.matrix=None
+        self.norms=None
+        # Column of each word id in the matrix (-1 for words not in
+        # the template; sized like self.wcounts), and the IDF weight
+        # of each column.
+        self.colOf=np.zeros(0, dtype=np.int64)
+        self.idf=None
+        # The k used to build the matrix; None means the template is
+        # the full vocabulary and the matrix is a SparseMatrix.
+        self.k=None
+        # Set when the corpus changes after the matrix is built.
+        self.dirty=False
+        # Version stamp, bumped whenever a speech is added or removed,
+        # and a cache of the matrices built for other values of k for
+        # the current version (see useVectors()).
+        self.version=0
+        self.cache=VectorCache()
+        # Optional instrumentation (see instrument()); None when off.
+        # It is turned on here if instrument is True or a callback is
+        # given, so that loading the index below is recorded too.
+        self.meter=None
+        # Optional approximate search settings (see approximate()),
+        # and the HyperplaneIndex built from them for the current
+        # matrix, made when first needed.
+        self.lsh=None
+        self.ann=None
+        # The AuthorIndex for the current matrix (see searchAuthors()),
+        # made when first needed.
+        self.authorIndex=None
+        if instrument or callback is not None:
+            self.instrument(True, callback)
+        if index is not None and os.path.exists(index):
+            self.load(index)
 
-    # Corpus().addSpeech(name) adds a speech to the corpus. The name
-    # argument is used to locate the file containing the speech in
-    # self.directory, and is also used to identify the speech in the
-    # dictionary of speeches within the corpus.
-    def addSpeech(self, name):
+    # Corpus().addSpeech(name, lean) adds a speech to the corpus. The
+    # name argument is used to locate the file containing the speech
+    # in self.directory, and is also used to identify the speech in
+    # the dictionary of speeches within the corpus. If lean is True,
+    # the Speech keeps only its word counts (see Speech()).
+    def addSpeech(self, name, lean=False):
         # Read in a Speech object, initialize it, and it to the
         # corpus (unless its already there).
         if name not in self.speeches:
             # Index new Speech() object by name in self.speeches. Note
             # that speech files are found in self.directory and always
             # carry a .txt file extension.
-            self.speeches[name]=(Speech("{}{}.txt".format(self.directory, name)))
+            with self.stage('parse'):
+                self.speeches[name]=(Speech("{}{}.txt".format(self.directory, name), lean, self.stemmed))
+            self.tally([ self.speeches[name] ])
  
             # Incorporate word frequencies from new speech into
             # corpus-level word frequencies.
-            self.updateFreqs(self.speeches[name])
+            with self.stage('updateFreqs'):
+                self.updateFreqs(self.speeches[name])
+
+    # Corpus().addSpeeches(names, workers) adds several speeches at
+    # once, parsing them in a pool of worker processes (see
+    # countSpeeches()). Workers return compact word frequency tables,
+    # which are merged into the Corpus in the order given by names, so
+    # the result is the same as calling addSpeech() on each name in
+    # turn. The speeches are lean: their text is re-read if needed
+    # (see Speech()).
+    def addSpeeches(self, names, workers=None):
+        # Skip speeches already in the corpus, and duplicates.
+        names = [ name for name in dict.fromkeys(names) if name not in self.speeches ]
+        filenames = [ "{}{}.txt".format(self.directory, name) for name in names ]
+        with self.stage('parse'):
+            counts = countSpeeches(filenames, workers, self.stemmed)
+        # Reduction step: fold each table into the corpus frequencies.
+        with self.stage('updateFreqs'):
+            for name, filename, (stamp, wfreq, length) in zip(names, filenames, counts):
+                self.speeches[name] = Speech.restore(filename, stamp, None, wfreq, length)
+                self.updateFreqs(self.speeches[name])
+        self.tally([ self.speeches[name] for name in names ])
+
+    # Corpus().addArchive(source, pattern, workers) adds the speeches
+    # read from source by readSpeeches() (a directory, glob or archive),
+    # skipping any already in the corpus, and returns their names. With
+    # one worker, each speech is streamed from the archive straight
+    # into the tokenizer; with more, the main process decompresses and
+    # reads the speeches while a pool of worker processes counts them
+    # (see countText()), keeping at most a few speeches per worker in
+    # flight. Either way, the result is the same as adding the speeches
+    # one at a time, in the order read. Speeches read from an archive
+    # have no file, so they are never re-parsed (see load()).
+    def addArchive(self, source, pattern="*.txt", workers=1):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        names = []
+        speeches = readSpeeches(source, pattern)
+        with self.stage('parse'):
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pending = []
+                    queued = set()
+                    for name, filename, infile in speeches:
+                        if name in self.speeches or name in queued:
+                            continue
+                        stamp = None if filename is None else fileStamp(filename)
+                        pending.append((name, filename, stamp, pool.submit(countText, infile.read(), self.stemmed)))
+                        queued.add(name)
+                        names.append(name)
+                        if len(pending) >= 4*workers:
+                            self.addCounted(*pending.pop(0))
+                    for item in pending:
+                        self.addCounted(*item)
+            else:
+                for name, filename, infile in speeches:
+                    if name not in self.speeches:
+                        self.speeches[name] = Speech.fromStream(infile, self.stemmed, filename)
+                        self.updateFreqs(self.speeches[name])
+                        names.append(name)
+        self.tally([ self.speeches[name] for name in names ])
+        return(names)
+
+    # Corpus().addCounted(name, filename, stamp, future) adds a speech
+    # counted by countText() in a worker, once the count is done.
+    def addCounted(self, name, filename, stamp, future):
+        wfreq, length = future.result()
+        self.speeches[name] = Speech.restore(filename, stamp, None, wfreq, length)
+        self.updateFreqs(self.speeches[name])
+
+    # Corpus().removeSpeech(name) removes the named speech from the
+    # corpus, if it is there, backing its word frequencies out of the
+    # corpus-level word frequencies.
+    def removeSpeech(self, name):
+        if name in self.speeches:
+            self.discountFreqs(self.speeches.pop(name))
 
     # Corpus().updateFreqs(speech) updates both the Corpus document
     # frequency and word frequency values using the word frequency
     # distribution of the specified speech as your guide. If the word
     # is in Speech.wfreq, it means it is in the document (i.e., the
     # speech you are incorporating); it also increases Corpus.wfreq.
+    #
+    # The speech is first interned into the Corpus vocabulary (see
+    # Speech().intern()), so that its counts can be added in with a
+    # single scatter-add over its word ids. Both this and
+    # discountFreqs() mark the corpus dirty.
     def updateFreqs(self, speech):
-        for word in speech.wfreq:
-            try:
-                self.dfreq[word] += 1
-                self.wfreq[word] += speech.wfreq[word]
-            except:
-                self.dfreq[word] = 1
-                self.wfreq[word] = speech.wfreq[word]
+        self.dirty = True
+        self.version += 1
+        self.cache.clear()
+        ids, counts = speech.intern(self.vocabulary)
+        self.grow(len(self.vocabulary))
+        old = self.wcounts[ids]
+        self.dcounts[ids] += 1
+        self.wcounts[ids] += counts
+        if self.ranking is not None:
+            for i, count in zip(ids.tolist(), old.tolist()):
+                self.rerank(i, count)
+
+    # Corpus().discountFreqs(speech) is the inverse of updateFreqs():
+    # it removes the contribution of the specified speech from both
+    # the Corpus document frequency and word frequency values. Words
+    # that no longer appear in any document keep their ids, but drop
+    # out of wfreq and dfreq.
+    def discountFreqs(self, speech):
+        self.dirty = True
+        self.version += 1
+        self.cache.clear()
+        ids, counts = speech.intern(self.vocabulary)
+        old = self.wcounts[ids]
+        self.dcounts[ids] -= 1
+        self.wcounts[ids] -= counts
+        if self.ranking is not None:
+            for i, count in zip(ids.tolist(), old.tolist()):
+                self.rerank(i, count)
+
+    # Corpus().grow(n) makes room in the arrays indexed by word id
+    # for at least n words, doubling their size as needed.
+    def grow(self, n):
+        if n > len(self.wcounts):
+            size = max(n, 2*len(self.wcounts))
+            for attr, fill in (('wcounts', 0), ('dcounts', 0), ('colOf', -1)):
+                old = getattr(self, attr)
+                new = np.full(size, fill, dtype=np.int64)
+                new[:len(old)] = old
+                setattr(self, attr, new)
+
+    # Corpus().rerank(i, old) moves word id i from the self.ranking
+    # bucket for its old count to the bucket for its current count in
+    # self.wcounts (a count of 0 means no bucket).
+    def rerank(self, i, old):
+        if old:
+            bucket = self.ranking[old]
+            del bucket[i]
+            if not bucket:
+                del self.ranking[old]
+        new = int(self.wcounts[i])
+        if new:
+            self.ranking.setdefault(new, {})[i] = None
 
     # Find the top k most frequently used words in the Corpus that do
     # not appear in every document. 
@@ -84,41 +730,1160 @@ class Corpus():
     # in the Corpus, then there will be no words in topK (because they
     # all appear in all of the Corpus documents).
     def topK(self, k):
-        L = [ (word, self.wfreq[word]) for word in self.wfreq.keys() if self.dfreq[word] != len(self.speeches) ]
-        for i in range(k):
-            j = i + L[i:].index(max(L[i:], key=lambda x: x[1]))
-            L[i],L[j] = L[j],L[i]
-        return([ record[0] for record in L[:k] ])
+        return(self.vocabulary.decode(self.topIds(k)))
+
+    # Corpus().topIds(k) returns the word ids of topK(k), as an array,
+    # exactly as the original selection sort would have picked them,
+    # ties included (see selectTop()). Only the words with at least
+    # the k-th largest count can be picked: if self.ranking is
+    # maintained, they are read off its buckets, from the largest
+    # count down; otherwise, np.partition finds the k-th largest count.
+    # Either way, the result depends only on the current counts and
+    # word ids, not on the order in which counts changed.
+    def topIds(self, k):
+        with self.stage('topK'):
+            N = len(self.speeches)
+            if k <= 0:
+                return(np.zeros(0, dtype=np.int64))
+            ids = self.candidates()
+            if self.ranking is None:
+                heavy = ids
+                if k < len(ids):
+                    counts = self.wcounts[ids]
+                    heavy = ids[counts >= np.partition(counts, -k)[-k]]
+                heavy = heavy.tolist()
+            else:
+                heavy = []
+                for count in sorted(self.ranking, reverse=True):
+                    if len(heavy) >= k:
+                        break
+                    heavy.extend([ i for i in self.ranking[count] if self.dcounts[i] != N ])
+            return(np.array(selectTop(heavy, self.wcounts, ids, k), dtype=np.int64))
+
+    # Corpus().candidates() returns the ids of the words that appear
+    # in some, but not all, of the documents, in order of id.
+    def candidates(self):
+        dcounts = self.dcounts[:len(self.vocabulary)]
+        return(np.flatnonzero((dcounts > 0) & (dcounts != len(self.speeches))))
 
     # Corpus().createVectors(k) finds the top k words and use them to
-    # define a vector template, then, tell each speech in the corpus
-    # to calculate its corresponding vector.
+    # define a vector template, then builds the document-term matrix
+    # with one TF/IDF row per speech (see Speech().makeVector()), and
+    # the row norms used by identify(). Each speech's vector is a view
+    # of its row.
     #
-    # Note if there are too few speeches in the Corpus, or they all
-    # rely on very similar vocabularies, then you may not find k words
-    # that don't appear in all of the Speeches. In this case, your
-    # vector will be shorter, and even empty (certainly the case when
-    # there is only 1 Speech in Corpus).
+    # If k is None, the template is instead every word that does not
+    # appear in every document (as if k were unlimited), and the
+    # matrix is a SparseMatrix, so memory stays proportional to the
+    # number of nonzero entries. Speeches get no vector in this case.
     def createVectors(self, k):
-        self.template = self.topK(k)
-        for i in self.speeches.keys():
-            self.speeches[i].makeVector(self.template, self.dfreq, len(self.speeches))
+        with self.stage('createVectors'):
+            ids = self.candidates() if k is None else self.topIds(k)
+            self.k = k
+            self.setTemplate(ids)
+            self.names = list(self.speeches)
+            self.vectorized = list(self.speeches.values())
+            self.tf = self.termFrequencies(self.vectorized)
+            self.dirty = False
+            self.weigh()
+
+    # Corpus().useVectors(k) makes the current matrix the one for the
+    # given k: if it is not already, the current matrix is put in
+    # self.cache, and the one for k taken from it, or made afresh if
+    # it is not there. Either way, entries are keyed by k and
+    # self.version, so that (k, matrix) pairs made before the corpus
+    # changed are never reused. If the matrix is already the one for
+    # k, it is just brought up to date.
+    def useVectors(self, k):
+        if self.matrix is not None and self.k == k:
+            if self.dirty:
+                self.event('refresh', k=k)
+                self.refresh()
+            return
+        if self.matrix is not None and not self.dirty:
+            state = (self.k, self.templateIds, self.names, self.vectorized, self.tf, self.matrix, self.norms, self.idf)
+            self.cache.put((self.k, self.version), state, sum([ m.nbytes for m in state[4:] ]))
+        state = self.cache.get((k, self.version))
+        if state is None:
+            self.event('createVectors', k=k)
+            self.createVectors(k)
+            return
+        self.event('cacheHit', k=k)
+        self.k, ids, self.names, self.vectorized, self.tf, self.matrix, self.norms, self.idf = state
+        self.setTemplate(ids)
+        self.ann = None
+        self.authorIndex = None
+        for row, speech in enumerate(self.vectorized):
+            speech.vector = None if k is None else self.matrix[row]
+
+    # Corpus().setTemplate(ids) makes the words with the given ids the
+    # template, in that order.
+    def setTemplate(self, ids):
+        self.template = self.vocabulary.decode(ids)
+        self.templateIds = ids
+        self.colOf[:] = -1
+        self.colOf[ids] = np.arange(len(ids))
+
+    # Corpus().refresh() brings the document-term matrix up to date
+    # after speeches have been added or removed, touching only what
+    # changed: rows are dropped for removed (or replaced) speeches and
+    # made for new ones, and template columns are swapped only if the
+    # top k words are no longer the same. Document frequencies and
+    # IDF weights are then recomputed for all columns at once. In
+    # sparse mode, the template only grows; columns for words that
+    # now appear in every document (or in none) get zero weight.
+    def refresh(self):
+        with self.stage('refresh'):
+            # Drop rows whose speech is gone or has been replaced.
+            keep = [ row for row, (name, speech) in enumerate(zip(self.names, self.vectorized)) if self.speeches.get(name) is speech ]
+            if len(keep) < len(self.names):
+                self.tf = self.tf.take(keep) if self.k is None else self.tf[keep]
+                self.names = [ self.names[row] for row in keep ]
+                self.vectorized = [ self.vectorized[row] for row in keep ]
+            # Update the template.
+            if self.k is None:
+                V = len(self.vocabulary)
+                new = np.flatnonzero((self.dcounts[:V] > 0) & (self.colOf[:V] < 0))
+                self.colOf[new] = np.arange(len(self.templateIds), len(self.templateIds) + len(new))
+                self.template.extend(self.vocabulary.decode(new))
+                self.templateIds = np.concatenate((self.templateIds, new))
+                self.tf.shape = (self.tf.shape[0], len(self.template))
+            else:
+                ids = self.topIds(self.k)
+                if set(ids.tolist()) != set(self.templateIds.tolist()):
+                    self.event('retemplate', k=self.k)
+                    self.retemplate(ids)
+            # Make rows for the new speeches.
+            rows = set(self.names)
+            added = [ name for name in self.speeches if name not in rows ]
+            if added:
+                self.names.extend(added)
+                self.vectorized.extend([ self.speeches[name] for name in added ])
+                tf = self.termFrequencies(self.vectorized[-len(added):])
+                self.tf = self.tf.stack(tf) if self.k is None else np.vstack((self.tf, tf))
+            self.dirty = False
+            self.weigh()
+
+    # Corpus().retemplate(ids) switches the dense term frequency
+    # matrix over to the template with the given word ids, reusing the
+    # columns of words in both the old and the new template, and
+    # computing columns only for the words that are new to it.
+    def retemplate(self, ids):
+        tf = np.zeros((len(self.names), len(ids)))
+        old = self.colOf[ids]
+        kept = np.flatnonzero(old >= 0)
+        tf[:, kept] = self.tf[:, old[kept]]
+        fresh = np.full(len(self.colOf), -1, dtype=np.int64)
+        fresh[ids[old < 0]] = np.flatnonzero(old < 0)
+        for row, speech in enumerate(self.vectorized):
+            cols = fresh[speech.ids]
+            hit = cols >= 0
+            tf[row, cols[hit]] = speech.counts[hit]/speech.length
+        self.setTemplate(ids)
+        self.tf = tf
+
+    # Corpus().weigh() recomputes the IDF weight of each column from
+    # its document frequency, and from them the TF/IDF matrix and its
+    # row norms. Columns for words in every document, or in none, get
+    # zero weight; createVectors() never includes such words, but they
+    # can linger in the template after refresh().
+    def weigh(self):
+        self.ann = None
+        self.authorIndex = None
+        N = len(self.names)
+        coldf = self.dcounts[self.templateIds].astype(np.float64)
+        with np.errstate(divide='ignore'):
+            self.idf = np.log(N/(1 + coldf))
+        self.idf[(coldf == N) | (coldf == 0)] = 0.0
+        if self.k is None:
+            self.matrix = self.tf.scale(self.idf)
+            self.norms = self.matrix.rowNorms()
+            for speech in self.vectorized:
+                speech.vector = None
+        else:
+            self.matrix = self.tf * self.idf
+            self.norms = np.sqrt(np.einsum('ij,ij->i', self.matrix, self.matrix))
+            for row, speech in enumerate(self.vectorized):
+                speech.vector = self.matrix[row]
+
+    # Corpus().termFrequencies(speeches) returns a matrix with the
+    # normalized term frequencies of each of the given speeches (which
+    # need not be in the corpus) for the current template as its rows.
+    # The matrix is a SparseMatrix if the template is the full
+    # vocabulary, and a dense array otherwise. Speeches interned in
+    # the Corpus vocabulary are mapped to columns by their word ids;
+    # others have their words looked up.
+    def termFrequencies(self, speeches):
+        indptr = [ 0 ]
+        cols = []
+        tfs = []
+        for speech in speeches:
+            if speech.vocabulary is self.vocabulary:
+                ids, counts = speech.ids, speech.counts
+            else:
+                wfreq = speech.wfreq
+                ids = self.vocabulary.lookup(wfreq)
+                counts = np.fromiter(wfreq.values(), dtype=np.int64, count=len(wfreq))
+                known = ids >= 0
+                ids, counts = ids[known], counts[known]
+            columns = self.colOf[ids]
+            hit = columns >= 0
+            cols.append(columns[hit])
+            tfs.append(counts[hit]/speech.length if speech.length else counts[hit].astype(np.float64))
+            indptr.append(indptr[-1] + len(cols[-1]))
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        tfs = np.concatenate(tfs) if tfs else np.zeros(0)
+        if self.k is None:
+            return(SparseMatrix(indptr, cols, tfs, len(self.template)))
+        matrix = np.zeros((len(speeches), len(self.template)))
+        matrix[np.repeat(np.arange(len(speeches)), np.diff(indptr)), cols] = tfs
+        return(matrix)
+
+    # Corpus().vectors(speeches) returns a matrix with the TF/IDF
+    # vector of each of the given speeches as its rows, using the
+    # current template and IDF weights (see termFrequencies()).
+    def vectors(self, speeches):
+        tf = self.termFrequencies(speeches)
+        if self.k is None:
+            return(tf.scale(self.idf))
+        return(tf * self.idf)
+
+    # Corpus().similarity(queries, rows) returns the matrix of cosine
+    # similarities (see Speech().cosSimilarity()) of each row of
+    # queries, as returned by vectors(), against each row of the
+    # document-term matrix, or only against the given rows of it.
+    def similarity(self, queries, rows=None):
+        matrix = self.matrix
+        norms = self.norms
+        if rows is not None:
+            matrix = matrix.take(rows) if self.k is None else matrix[rows]
+            norms = norms[rows]
+        return(cosines(queries, matrix, norms))
+
+    # Corpus().rank(scores, j, rows) returns the j best (score, name)
+    # pairs, best first, for the scores of the rows of the matrix (or
+    # of the given rows only). Only the candidates scoring at least
+    # the j-th best score are sorted, and ties are broken by name,
+    # just as if all pairs had been sorted.
+    def rank(self, scores, j, rows=None):
+        candidates = range(len(scores))
+        if 0 < j < len(scores):
+            candidates = np.flatnonzero(scores >= np.partition(scores, -j)[-j])
+        if rows is None:
+            return(sorted([ (float(scores[i]), self.names[i]) for i in candidates ], reverse=True)[:j])
+        return(sorted([ (float(scores[i]), self.names[rows[i]]) for i in candidates ], reverse=True)[:j])
+
+    # Corpus().approximate(tables, bits, probes, seed) makes identify()
+    # search a HyperplaneIndex of the vectors for a shortlist of
+    # candidates, and score only those exactly, trading some recall
+    # for speed on large corpora (see HyperplaneIndex() for what the
+    # settings do). approximate(0) goes back to exact search. The
+    # defaults suit tens of thousands of speeches; with fewer, buckets
+    # are too sparse and recall drops (to about a third at 5000 in
+    # bench.py ann), so use fewer bits.
+    def approximate(self, tables=8, bits=12, probes=1, seed=0):
+        self.lsh = (tables, bits, probes, seed) if tables else None
+        self.ann = None
+
+    # Corpus().search(speeches, j) returns the j closest matches in
+    # the corpus for each of the given speeches, which must be scored
+    # against the current vectors (see identifyMany()). If a shortlist
+    # from the approximate index has fewer than j speeches on it, the
+    # whole corpus is searched instead.
+    def search(self, speeches, j):
+        with self.stage('score'):
+            queries = self.vectors(speeches)
+            if self.lsh is None:
+                return([ self.rank(row, j) for row in self.similarity(queries) ])
+            if self.ann is None:
+                self.ann = HyperplaneIndex(self.matrix, *self.lsh)
+            results = []
+            exhaustive = []
+            for i, rows in enumerate(self.ann.candidates(queries)):
+                if len(rows) < j:
+                    exhaustive.append(i)
+                    results.append(None)
+                    continue
+                query = queries.take([ i ]) if self.k is None else queries[i:i+1]
+                results.append(self.rank(self.similarity(query, rows)[0], j, rows))
+            # Score the queries with short shortlists together.
+            if exhaustive:
+                scores = self.similarity(queries.take(exhaustive) if self.k is None else queries[exhaustive])
+                for i, row in zip(exhaustive, scores):
+                    results[i] = self.rank(row, j)
+            return(results)
+
+    # Corpus().searchAuthors(speeches, j, authors) is a two-stage
+    # search(): each speech is first scored against the centroid of
+    # each author's vectors (see AuthorIndex()), and then exactly
+    # against the speeches of the given number of best scoring
+    # authors only. Returns, for each speech, a pair of rankings: the
+    # best (score, author) pairs, and the j best (score, name) pairs
+    # from those authors' speeches. Raises ValueError unless authors
+    # is at least 1.
+    def searchAuthors(self, speeches, j, authors=3):
+        if authors < 1:
+            raise ValueError("authors must be at least 1, not {}".format(authors))
+        with self.stage('score'):
+            if self.authorIndex is None:
+                self.authorIndex = AuthorIndex(self.matrix, self.norms, self.names)
+            index = self.authorIndex
+            queries = self.vectors(speeches)
+            results = []
+            for i, scores in enumerate(cosines(queries, index.centroids, index.norms)):
+                candidates = range(len(scores))
+                if authors < len(scores):
+                    candidates = np.flatnonzero(scores >= np.partition(scores, -authors)[-authors])
+                best = sorted([ (float(scores[a]), index.authors[a]) for a in candidates ], reverse=True)[:authors]
+                rows = np.sort(np.concatenate([ index.members[index.number[author]] for (score, author) in best ]))
+                query = queries.take([ i ]) if self.k is None else queries[i:i+1]
+                results.append((best, self.rank(self.similarity(query, rows)[0], j, rows)))
+            return(results)
+
+    # Corpus().identifyAuthors(mysteries, k, j, authors, workers) is
+    # identifyMany() using searchAuthors(), returning for each mystery
+    # the rankings of the best authors and of their j best speeches.
+    def identifyAuthors(self, mysteries, k, j, authors=3, workers=None):
+        self.useVectors(k)
+        return(self.searchAuthors(self.mysterySpeeches(mysteries, workers), j, authors))
+
+    # Corpus().identifyAuthor(mystery, k, j, authors) is
+    # identifyAuthors() for a single mystery.
+    def identifyAuthor(self, mystery, k, j, authors=3):
+        return(self.identifyAuthors([ mystery ], k, j, authors, workers=1)[0])
 
     # Corpus().identify(mystery, k, j) takes a mystery filename and
     # matches it against all the speeches using TDIDF vectors of
-    # length k, returning the j closest matches.
+    # length k, returning the j closest matches. If k is None, sparse
+    # vectors over the full vocabulary are used (see createVectors()).
     def identify(self, mystery, k, j):
-        # Create new vectors if k is different.
-        if len(self.template) != k:
-            self.createVectors(k)
-        # Read in the unidentified speech.
-        unidentified = Speech("{}{}.txt".format(self.directory, mystery))
-        unidentified.makeVector(self.template, self.dfreq, len(self.speeches))
-        return(sorted([ (self.speeches[s].cosSimilarity(unidentified), s) for s in self.speeches.keys() ], reverse=True)[:j])
+        return(self.identifyMany([ mystery ], k, j, workers=1)[0])
+
+    # Corpus().identifyMany(mysteries, k, j, workers) is identify()
+    # for a list of mystery filenames, returning a list with the j
+    # closest matches for each. The mystery speeches are parsed in
+    # parallel (see countSpeeches()), and all of them are scored in a
+    # single matrix-matrix product (or, for sparse vectors, one sparse
+    # product per mystery).
+    def identifyMany(self, mysteries, k, j, workers=None):
+        # Switch to the vectors for k (see useVectors()).
+        self.useVectors(k)
+        return(self.search(self.mysterySpeeches(mysteries, workers), j))
+
+    # Corpus().mysterySpeeches(mysteries, workers) reads in the named
+    # mystery speeches from the corpus directory, in parallel (see
+    # countSpeeches()), returning them as lean Speeches.
+    def mysterySpeeches(self, mysteries, workers=None):
+        filenames = [ "{}{}.txt".format(self.directory, mystery) for mystery in mysteries ]
+        with self.stage('parse'):
+            unidentified = [ Speech.restore(filename, stamp, None, wfreq, length)
+                             for filename, (stamp, wfreq, length) in zip(filenames, countSpeeches(filenames, workers, self.stemmed)) ]
+        self.tally(unidentified)
+        return(unidentified)
+
+    # Corpus().instrument(enabled, callback) turns instrumentation on
+    # (with fresh counts) or off. While it is on, the Corpus keeps the
+    # number of calls to, and the wall and CPU time spent in, each
+    # stage of its work (see stage()), the file bytes and tokens of
+    # the speeches it has parsed, the number of times the files of its
+    # lean speeches have been re-read, and counts of events such as
+    # vectors being rebuilt or taken from the cache; see metrics(). If
+    # given, callback(record) is also called with a dictionary
+    # describing each stage as it ends, and each event as it happens.
+    # When off, each stage costs only a method call. To also record
+    # loading an index, pass instrument or callback to Corpus().
+    def instrument(self, enabled=True, callback=None):
+        self.meter = Meter(callback) if enabled else None
+        for speech in self.speeches.values():
+            speech.rereads = speech.rereadBytes = 0
+
+    # Corpus().stage(name) returns a context manager that times the
+    # work done within it as the named stage; stages may nest, in
+    # which case the outer stage's times include the inner's. CPU time
+    # is for this process only, so it leaves out work done by worker
+    # processes (see countSpeeches()).
+    def stage(self, name):
+        if self.meter is None:
+            return(IDLE)
+        return(self.meter.stage(name))
+
+    # Corpus().event(name, **info) records an event, if instrumented.
+    def event(self, name, **info):
+        if self.meter is not None:
+            self.meter.event(name, info)
+
+    # Corpus().tally(speeches) counts the speeches, the sizes of the
+    # files they were parsed from (as stamped, whether the file was
+    # read here or by a worker process; see countSpeeches()) and their
+    # tokens, if instrumented. Speeches made from text (see
+    # Speech.fromText()) count no file bytes.
+    def tally(self, speeches):
+        if self.meter is not None:
+            self.meter.count('speeches', len(speeches))
+            self.meter.count('fileBytes', sum([ speech.stamp[1] for speech in speeches if speech.stamp is not None ]))
+            self.meter.count('tokens', sum([ speech.length for speech in speeches ]))
+
+    # Corpus().metrics() returns a snapshot of the instrumentation as
+    # a dictionary: the stage times, counters and events recorded so
+    # far (empty if not instrumented), along with the current number
+    # of speeches, vocabulary size, k and vector cache statistics. The
+    # 'rereads' and 'rereadBytes' counters are summed over the lean
+    # speeches now in the Corpus (see Speech().parse()).
+    def metrics(self):
+        snapshot = self.meter.snapshot() if self.meter is not None else { 'stages':{}, 'counters':{}, 'events':{} }
+        if self.meter is not None:
+            snapshot['counters']['rereads'] = sum([ speech.rereads for speech in self.speeches.values() ])
+            snapshot['counters']['rereadBytes'] = sum([ speech.rereadBytes for speech in self.speeches.values() ])
+        snapshot.update({ 'enabled':self.meter is not None, 'speeches':len(self.speeches),
+                          'vocabulary':len(self.vocabulary), 'k':self.k, 'cache':self.cache.stats() })
+        return(snapshot)
+
+    # Corpus().save(filename) writes the Corpus to an index file: an
+    # uncompressed NumPy .npz archive of arrays (the vocabulary's word
+    # and document counts, the word ids and counts of every speech, the
+    # template and, if built, the term frequency matrix, from which the
+    # document-term matrix is recomputed on loading) along with a JSON
+    # header holding everything else: the format version, directory,
+    # stemming, vocabulary, k and matrix row names, and for each
+    # speech, its name, filename, file stamp, content hash and length.
+    # Nothing in it is executable, so an index file can be loaded
+    # without being trusted. If filename is omitted, self.index is
+    # used.
+    def save(self, filename=None):
+        with self.stage('save'):
+            if filename is None:
+                filename = self.index
+            records = []
+            ids = []
+            counts = []
+            for name, speech in self.speeches.items():
+                # Only record a content hash if the file is still the one
+                # that was parsed; otherwise leave it out so the speech is
+                # re-parsed on the next load. The hash is kept, so later
+                # saves need not compute it again.
+                if speech.digest is None and speech.filename is not None and fileStamp(speech.filename) == speech.stamp:
+                    speech.digest = fileDigest(speech.filename)
+                speechIds, speechCounts = speech.intern(self.vocabulary)
+                ids.append(speechIds)
+                counts.append(speechCounts)
+                records.append((name, speech.filename, speech.stamp, speech.digest, speech.length))
+            # Bring the matrix up to date first, so that the names saved
+            # with it match its rows.
+            if self.dirty and self.matrix is not None:
+                self.refresh()
+            V = len(self.vocabulary)
+            arrays = { 'wcounts':self.wcounts[:V], 'dcounts':self.dcounts[:V], 'template':self.templateIds,
+                       'ids':np.concatenate(ids) if ids else np.zeros(0, dtype=np.uint32),
+                       'counts':np.concatenate(counts) if counts else np.zeros(0, dtype=np.uint32),
+                       'offsets':np.cumsum([ 0 ] + [ len(row) for row in ids ], dtype=np.int64) }
+            if isinstance(self.tf, SparseMatrix):
+                arrays.update({ 'indptr':self.tf.indptr, 'indices':self.tf.indices, 'data':self.tf.data })
+            elif self.tf is not None:
+                arrays['tf'] = self.tf
+            header = { 'version':INDEXVERSION, 'directory':self.directory, 'stemmed':self.stemmed,
+                       'vocabulary':self.vocabulary.words, 'speeches':records,
+                       'vectors':self.tf is not None, 'k':self.k, 'names':self.names }
+            arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+            # Write to a temporary file first, so that an interrupted save
+            # never leaves a truncated index behind.
+            with open(filename + '.tmp', 'wb') as outfile:
+                np.savez(outfile, **arrays)
+            os.replace(filename + '.tmp', filename)
+
+    # Corpus().readIndex(filename) reads and checks an index file written
+    # by Corpus().save(), returning its header and arrays, or None if
+    # the file can not be read, is not a consistent index, or was
+    # written by an incompatible version, for another directory, or
+    # with(out) stemming.
+    def readIndex(self, filename):
+        try:
+            with np.load(filename, allow_pickle=False) as archive:
+                header = json.loads(archive['header'].tobytes().decode('utf-8'))
+                if header.get('version') != INDEXVERSION or header.get('directory') != self.directory or header.get('stemmed') != self.stemmed:
+                    return(None)
+                arrays = { key:archive[key] for key in archive.files }
+            V = len(header['vocabulary'])
+            S = len(header['speeches'])
+            offsets = arrays['offsets']
+            checks = [ arrays['wcounts'].shape == (V,), arrays['dcounts'].shape == (V,),
+                       offsets.shape == (S + 1,), offsets[0] == 0, (np.diff(offsets) >= 0).all(),
+                       offsets[-1] == len(arrays['ids']) == len(arrays['counts']),
+                       ((arrays['ids'] < V).all()), ((arrays['template'] >= 0) & (arrays['template'] < V)).all(),
+                       len({ record[0] for record in header['speeches'] } | set(header['names'])) == S ]
+            if header['vectors']:
+                R = len(header['names'])
+                C = len(arrays['template'])
+                if header['k'] is None:
+                    indptr = arrays['indptr']
+                    checks += [ indptr.shape == (R + 1,), indptr[0] == 0, (np.diff(indptr) >= 0).all(),
+                                indptr[-1] == len(arrays['indices']) == len(arrays['data']),
+                                ((arrays['indices'] >= 0) & (arrays['indices'] < C)).all() ]
+                else:
+                    checks.append(arrays['tf'].shape == (R, C))
+            if not all(checks):
+                return(None)
+        except Exception:
+            return(None)
+        return((header, arrays))
+
+    # Corpus().load(filename) restores the Corpus from an index file
+    # written by Corpus().save(). Each speech file is checked against
+    # its recorded stamp (and, if the stamp has moved, its content
+    # hash); changed speeches are re-parsed, and speeches whose files
+    # have disappeared are dropped. Speeches with no file (read from an
+    # archive by addArchive()) are kept as they are. The matrix is then
+    # brought up to date on the next identify() (see refresh()).
+    # Returns False (leaving the Corpus untouched, so that the speeches
+    # are parsed afresh) if readIndex() rejects the file.
+    def load(self, filename):
+        with self.stage('load'):
+            state = self.readIndex(filename)
+            if state is None:
+                self.event('badindex')
+                return(False)
+            header, arrays = state
+            self.cache.clear()
+            self.vocabulary = Vocabulary(header['vocabulary'])
+            self.wcounts = np.zeros(0, dtype=np.int64)
+            self.dcounts = np.zeros(0, dtype=np.int64)
+            self.colOf = np.zeros(0, dtype=np.int64)
+            self.grow(len(self.vocabulary))
+            self.wcounts[:len(self.vocabulary)] = arrays['wcounts']
+            self.dcounts[:len(self.vocabulary)] = arrays['dcounts']
+            self.speeches = {}
+            offsets = arrays['offsets'].tolist()
+            for n, (name, filename, stamp, digest, length) in enumerate(header['speeches']):
+                stamp = None if stamp is None else tuple(stamp)
+                self.speeches[name] = Speech.restore(filename, stamp, digest, None, length)
+                self.speeches[name].adopt(self.vocabulary, arrays['ids'][offsets[n]:offsets[n+1]], arrays['counts'][offsets[n]:offsets[n+1]])
+            if self.ranking is not None:
+                self.ranking = {}
+                for i in np.flatnonzero(self.wcounts).tolist():
+                    self.rerank(i, 0)
+            self.setTemplate(arrays['template'])
+            if header['vectors']:
+                self.k = header['k']
+                self.names = header['names']
+                self.vectorized = [ self.speeches[name] for name in self.names ]
+                if self.k is None:
+                    self.tf = SparseMatrix(arrays['indptr'], arrays['indices'], arrays['data'], len(self.template))
+                else:
+                    self.tf = arrays['tf']
+                self.weigh()
+            self.dirty = False
+            for name, speech in list(self.speeches.items()):
+                if speech.filename is None or speech.current():
+                    continue
+                # Stale entry: back out its old counts, then re-parse it
+                # if the file still exists.
+                self.removeSpeech(name)
+                if os.path.exists(speech.filename):
+                    self.event('reparse', speech=name)
+                    self.speeches[name] = Speech(speech.filename, lean=True, stemmed=self.stemmed)
+                    self.tally([ self.speeches[name] ])
+                    self.updateFreqs(self.speeches[name])
+            return(True)
+
+    # Corpus().export(filename) writes the current document-term
+    # matrix (brought up to date first), its row norms, the IDF
+    # weights, the template and the speech names to a flat file that
+    # VectorStore() can map into memory. The file starts with
+    # STOREMAGIC and the length of a JSON header, which gives k, the
+    # corpus directory, and the dtype, shape and offset of each of the
+    # arrays that follow it (each aligned to 64 bytes). Words and names
+    # are stored as UTF-8 blobs with arrays of offsets into them.
+    def export(self, filename):
+        if self.matrix is None:
+            raise ValueError("no vectors to export; call createVectors() first")
+        if self.dirty:
+            self.refresh()
+        arrays = { 'norms':self.norms, 'idf':self.idf }
+        if self.k is None:
+            arrays.update({ 'indptr':self.matrix.indptr, 'indices':self.matrix.indices,
+                            'data':self.matrix.data, 'rows':self.matrix.rows })
+        else:
+            arrays['matrix'] = self.matrix
+        for key, strings in (('template', self.template), ('names', [ str(name) for name in self.names ])):
+            encoded = [ string.encode('utf-8') for string in strings ]
+            arrays[key] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            arrays[key + 'Offsets'] = np.cumsum([ 0 ] + [ len(string) for string in encoded ], dtype=np.int64)
+        header = { 'version':STOREVERSION, 'k':self.k, 'ncols':len(self.template),
+                   'directory':self.directory, 'stemmed':self.stemmed, 'arrays':{} }
+        offset = 0
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            arrays[key] = array
+            header['arrays'][key] = (array.dtype.str, array.shape, offset)
+            offset += -(-array.nbytes//64)*64
+        encoded = json.dumps(header).encode('utf-8')
+        start = -(-(len(STOREMAGIC) + 8 + len(encoded))//64)*64
+        with open(filename + '.tmp', 'wb') as outfile:
+            outfile.write(STOREMAGIC + len(encoded).to_bytes(8, 'little') + encoded)
+            for key, array in arrays.items():
+                outfile.write(b'\0'*(start + header['arrays'][key][2] - outfile.tell()))
+                outfile.write(array.tobytes())
+        os.replace(filename + '.tmp', filename)
+
+# Shared do-nothing context manager for Corpus().stage() when the
+# Corpus is not instrumented.
+IDLE=nullcontext()
+
+# The Meter() class accumulates the instrumentation of a Corpus (see
+# Corpus().instrument()): per stage, the number of calls and the total
+# wall and CPU time in seconds; named counters; and event counts.
+class Meter():
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}
+        self.counters = {}
+        self.events = {}
+
+    # Meter().stage(name) returns a context manager that adds the time
+    # spent within it to the named stage.
+    def stage(self, name):
+        return(Stage(self, name))
+
+    # Meter().record(name, wall, cpu) adds one call of the named stage.
+    def record(self, name, wall, cpu):
+        totals = self.stages.setdefault(name, [ 0, 0.0, 0.0 ])
+        totals[0] += 1
+        totals[1] += wall
+        totals[2] += cpu
+        if self.callback is not None:
+            self.callback({ 'stage':name, 'wall':wall, 'cpu':cpu })
+
+    # Meter().count(name, n) adds n to the named counter.
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # Meter().event(name, info) counts the named event, passing it on
+    # with the given details to the callback, if any.
+    def event(self, name, info):
+        self.events[name] = self.events.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback(dict(info, event=name))
+
+    # Meter().snapshot() returns copies of the totals so far.
+    def snapshot(self):
+        return({ 'stages':{ name:{ 'calls':calls, 'wall':wall, 'cpu':cpu } for (name, (calls, wall, cpu)) in self.stages.items() },
+                 'counters':dict(self.counters), 'events':dict(self.events) })
+
+# The Stage() class is the context manager returned by Meter().stage().
+class Stage():
+    __slots__ = ('meter', 'name', 'wall', 'cpu')
+
+    def __init__(self, meter, name):
+        self.meter = meter
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return(self)
+
+    def __exit__(self, *exc):
+        self.meter.record(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+        return(False)
+
+# The Vocabulary() class numbers words with consecutive integer ids,
+# in the order they are first seen, so that the word frequencies of
+# a speech can be held as compact arrays of ids and counts, and those
+# of a Corpus as arrays indexed by id. Each distinct word is stored
+# only once, however many speeches use it.
+class Vocabulary():
+    def __init__(self, words=()):
+        self.words = list(words)
+        self.ids = { word:i for (i, word) in enumerate(self.words) }
+
+    def __len__(self):
+        return(len(self.words))
+
+    # Vocabulary().intern(words) returns the ids of the given words
+    # as an array, numbering any words not seen before.
+    def intern(self, words):
+        ids = self.ids
+        L = []
+        for word in words:
+            i = ids.get(word)
+            if i is None:
+                i = ids[word] = len(self.words)
+                self.words.append(word)
+            L.append(i)
+        return(np.array(L, dtype=np.uint32))
+
+    # Vocabulary().lookup(words) returns the ids of the given words
+    # as an array, with -1 for words not in the vocabulary.
+    def lookup(self, words):
+        return(np.fromiter([ self.ids.get(word, -1) for word in words ], dtype=np.int64, count=len(words)))
+
+    # Vocabulary().decode(ids) returns the list of words with the
+    # given ids.
+    def decode(self, ids):
+        return([ self.words[i] for i in ids.tolist() ])
+
+# The FreqView() class presents one of the count arrays of a Corpus
+# (wcounts or dcounts) as a read-only dictionary from words to counts,
+# so that Corpus().wfreq and Corpus().dfreq can still be used as
+# before. Only words with nonzero counts are included, in id order.
+class FreqView(Mapping):
+    def __init__(self, corpus, attr):
+        self.corpus = corpus
+        self.attr = attr
+
+    def __getitem__(self, word):
+        i = self.corpus.vocabulary.ids.get(word)
+        if i is None or not getattr(self.corpus, self.attr)[i]:
+            raise KeyError(word)
+        return(int(getattr(self.corpus, self.attr)[i]))
+
+    def __iter__(self):
+        counts = getattr(self.corpus, self.attr)[:len(self.corpus.vocabulary)]
+        return(iter(self.corpus.vocabulary.decode(np.flatnonzero(counts))))
+
+    def __len__(self):
+        return(int(np.count_nonzero(getattr(self.corpus, self.attr))))
+
+# The SparseMatrix() class is a minimal compressed sparse row (CSR)
+# matrix with the given number of columns: the nonzero values of row
+# i are data[indptr[i]:indptr[i+1]], found in the columns given by
+# the same slice of indices.
+class SparseMatrix():
+    def __init__(self, indptr, indices, data, ncols, rows=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        self.shape = (len(self.indptr) - 1, ncols)
+        # Row number of each nonzero entry, used to sum products by
+        # row with np.bincount() (computed unless given).
+        if rows is None:
+            rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    # SparseMatrix().nbytes is the memory held by the matrix arrays.
+    @property
+    def nbytes(self):
+        return(self.indptr.nbytes + self.indices.nbytes + self.data.nbytes + self.rows.nbytes)
+
+    # SparseMatrix().scale(weights) returns a copy of the matrix with
+    # each column multiplied by the corresponding weight.
+    def scale(self, weights):
+        return(SparseMatrix(self.indptr, self.indices, self.data*weights[self.indices], self.shape[1]))
+
+    # SparseMatrix().take(rows) returns a matrix made of the given
+    # rows of this one, in the given order.
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # Position of each kept entry: its row's start plus its offset
+        # within the row.
+        starts = np.repeat(self.indptr[rows], lengths)
+        offsets = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths)
+        return(SparseMatrix(indptr, self.indices[starts + offsets], self.data[starts + offsets], self.shape[1]))
+
+    # SparseMatrix().stack(other) returns a matrix with the rows of
+    # other below those of this one.
+    def stack(self, other):
+        indptr = np.concatenate((self.indptr, other.indptr[1:] + self.indptr[-1]))
+        return(SparseMatrix(indptr, np.concatenate((self.indices, other.indices)),
+                            np.concatenate((self.data, other.data)), max(self.shape[1], other.shape[1])))
+
+    # SparseMatrix().rowNorms() returns the magnitude of each row.
+    def rowNorms(self):
+        return(np.sqrt(np.bincount(self.rows, weights=self.data*self.data, minlength=self.shape[0])))
+
+    # SparseMatrix().dot(vector) returns the product of the matrix
+    # with the given dense vector of length ncols, or with each column
+    # of the given dense matrix with ncols rows.
+    def dot(self, vector):
+        if vector.ndim == 1:
+            return(np.bincount(self.rows, weights=self.data*vector[self.indices], minlength=self.shape[0]))
+        return(np.stack([ self.dot(column) for column in vector.T ], axis=1))
+
+    # SparseMatrix().products(other) returns the dense matrix of dot
+    # products of each row of this matrix with each row of other
+    # (i.e., self @ other.T). Each row of self is scattered into a
+    # dense buffer in turn and multiplied through other.
+    def products(self, other):
+        products = np.zeros((self.shape[0], other.shape[0]))
+        buffer = np.zeros(self.shape[1])
+        for i in range(self.shape[0]):
+            cols = self.indices[self.indptr[i]:self.indptr[i+1]]
+            buffer[cols] = self.data[self.indptr[i]:self.indptr[i+1]]
+            products[i] = other.dot(buffer)
+            buffer[cols] = 0.0
+        return(products)
+
+# The VectorCache() class is a least recently used (LRU) cache of
+# values of known size in bytes, used by Corpus().useVectors() to keep
+# the matrices for several values of k. It holds at most the given
+# number of entries and nbytes bytes, evicting the least recently
+# used entries to make room; a value larger than nbytes on its own is
+# not kept at all. Hits and misses are counted (see stats()).
+class VectorCache():
+    def __init__(self, entries=4, nbytes=1<<28):
+        self.entries = entries
+        self.nbytes = nbytes
+        self.values = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return(len(self.values))
+
+    # VectorCache().get(key) returns the value for key (marking it as
+    # most recently used), or None if there is none.
+    def get(self, key):
+        if key not in self.values:
+            self.misses += 1
+            return(None)
+        self.hits += 1
+        self.values.move_to_end(key)
+        return(self.values[key][0])
+
+    # VectorCache().put(key, value, nbytes) adds the value, of the
+    # given size, for key, replacing any value it already has.
+    def put(self, key, value, nbytes):
+        self.pop(key)
+        if nbytes > self.nbytes or self.entries <= 0:
+            return
+        while self.values and (len(self.values) >= self.entries or self.size + nbytes > self.nbytes):
+            self.pop(next(iter(self.values)))
+        self.values[key] = (value, nbytes)
+        self.size += nbytes
+
+    # VectorCache().pop(key) removes the value for key, if any.
+    def pop(self, key):
+        if key in self.values:
+            self.size -= self.values.pop(key)[1]
+
+    # VectorCache().clear() removes all the values (but keeps the
+    # hit and miss counts).
+    def clear(self):
+        if self.values:
+            self.values.clear()
+            self.size = 0
+
+    # VectorCache().stats() returns the hit and miss counts, and the
+    # number and total size of the values held.
+    def stats(self):
+        return({ 'hits':self.hits, 'misses':self.misses, 'entries':len(self.values), 'nbytes':self.size })
+
+# The HyperplaneIndex() class is an approximate nearest neighbour
+# index for cosine similarity over the rows of a dense array or
+# SparseMatrix, using random hyperplane locality sensitive hashing.
+# In each of the given number of tables, a row hashes to the bucket
+# given by the signs of its projections onto bits random hyperplanes,
+# so rows at a small angle to each other are likely to share a bucket
+# in at least one table. More tables raise recall; more bits make
+# the buckets, and so the shortlists, smaller. Probing the buckets
+# one bit flip away from the query's own, for the probes bits with
+# the smallest projections, raises recall without more tables.
+#
+# The hyperplanes are held as a dense (columns x tables*bits) float64
+# array, i.e. 8*tables*bits bytes per column: 768 bytes per column at
+# the default settings, or about 23 MB for a 30000-word template. In
+# sparse mode (k=None) the columns are the whole vocabulary, so this
+# grows with it, e.g. to 768 MB at a million words.
+class HyperplaneIndex():
+    def __init__(self, matrix, tables=8, bits=12, probes=1, seed=0):
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        self.planes = np.random.default_rng(seed).standard_normal((matrix.shape[1], tables*bits))
+        self.weights = 1 << np.arange(bits, dtype=np.int64)
+        # For each table, a dictionary of arrays of row numbers
+        # indexed by bucket key.
+        self.buckets = []
+        keys, projections = self.hash(matrix)
+        for table in range(tables):
+            order = np.argsort(keys[:, table], kind='stable')
+            values, starts = np.unique(keys[order, table], return_index=True)
+            self.buckets.append(dict(zip(values.tolist(), np.split(order, starts[1:]))))
+
+    # HyperplaneIndex().hash(matrix) returns the bucket key of each
+    # row of matrix in each table, along with the projections of the
+    # rows onto the hyperplanes, reshaped as (rows, tables, bits).
+    def hash(self, matrix):
+        projections = matrix.dot(self.planes) if isinstance(matrix, SparseMatrix) else matrix @ self.planes
+        projections = projections.reshape(matrix.shape[0], self.tables, self.bits)
+        return(((projections > 0) @ self.weights, projections))
+
+    # HyperplaneIndex().candidates(queries) returns, for each row of
+    # queries, the sorted array of rows found in its buckets.
+    def candidates(self, queries):
+        keys, projections = self.hash(queries)
+        flips = np.argsort(np.abs(projections), axis=2)[:, :, :self.probes]
+        shortlists = []
+        for i in range(len(keys)):
+            found = []
+            for table in range(self.tables):
+                key = int(keys[i, table])
+                for probe in [ key ] + [ key ^ (1 << int(bit)) for bit in flips[i, table] ]:
+                    if probe in self.buckets[table]:
+                        found.append(self.buckets[table][probe])
+            shortlists.append(np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64))
+        return(shortlists)
+
+# The VectorStore() class opens a file written by Corpus().export()
+# read-only with mmap, and answers identify() from it alone: the
+# matrix, norms and IDF weights are NumPy views of the mapped file, so
+# all the processes that open the same file share one physical copy,
+# and no speech is loaded or parsed but the mysteries. Only the names
+# and the map from template words to columns are copied into each
+# process. The store uses the k it was exported with.
+class VectorStore():
+    def __init__(self, filename):
+        with open(filename, 'rb') as infile:
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(STOREMAGIC)] != STOREMAGIC:
+            raise ValueError("{} is not a vector store".format(filename))
+        size = int.from_bytes(self.map[len(STOREMAGIC):len(STOREMAGIC)+8], 'little')
+        header = json.loads(self.map[len(STOREMAGIC)+8:len(STOREMAGIC)+8+size].decode('utf-8'))
+        if header['version'] != STOREVERSION:
+            raise ValueError("{} has unsupported version {}".format(filename, header['version']))
+        start = -(-(len(STOREMAGIC) + 8 + size)//64)*64
+        arrays = {}
+        for key, (dtype, shape, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            arrays[key] = np.frombuffer(self.map, dtype=dtype, count=count, offset=start + offset).reshape(shape)
+        self.k = header['k']
+        self.directory = header['directory']
+        self.stemmed = header.get('stemmed', False)
+        self.norms = arrays['norms']
+        self.idf = arrays['idf']
+        if self.k is None:
+            self.matrix = SparseMatrix(arrays['indptr'], arrays['indices'], arrays['data'], header['ncols'], arrays['rows'])
+        else:
+            self.matrix = arrays['matrix']
+        self.template = self.strings(arrays['template'], arrays['templateOffsets'])
+        self.names = self.strings(arrays['names'], arrays['namesOffsets'])
+        self.columns = { word:i for (i, word) in enumerate(self.template) }
+
+    # VectorStore.strings(blob, offsets) decodes the strings packed
+    # into blob by Corpus().export().
+    @staticmethod
+    def strings(blob, offsets):
+        text = blob.tobytes()
+        offsets = offsets.tolist()
+        return([ text[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1) ])
+
+    # VectorStore().useVectors(k) checks that the store was exported
+    # with the given k, so that a VectorStore can stand in for a
+    # Corpus in server.py.
+    def useVectors(self, k):
+        if k != self.k:
+            raise ValueError("vector store has k={}, not {}".format(self.k, k))
+
+    # VectorStore().vectors(speeches) returns a matrix with the TF/IDF
+    # vector of each of the given speeches as its rows (as
+    # Corpus().vectors() does).
+    def vectors(self, speeches):
+        indptr = [ 0 ]
+        cols = []
+        tfs = []
+        for speech in speeches:
+            wfreq = speech.wfreq
+            columns = np.fromiter([ self.columns.get(word, -1) for word in wfreq ], dtype=np.int64, count=len(wfreq))
+            counts = np.fromiter(wfreq.values(), dtype=np.int64, count=len(wfreq))
+            hit = columns >= 0
+            cols.append(columns[hit])
+            tfs.append(counts[hit]/speech.length if speech.length else counts[hit].astype(np.float64))
+            indptr.append(indptr[-1] + len(cols[-1]))
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        tfs = np.concatenate(tfs) if tfs else np.zeros(0)
+        if self.k is None:
+            return(SparseMatrix(indptr, cols, tfs*self.idf[cols], len(self.template)))
+        matrix = np.zeros((len(speeches), len(self.template)))
+        matrix[np.repeat(np.arange(len(speeches)), np.diff(indptr)), cols] = tfs
+        return(matrix * self.idf)
+
+    # The scoring and ranking are those of Corpus().
+    similarity = Corpus.similarity
+    rank = Corpus.rank
+
+    # VectorStore().search(speeches, j) returns the j closest matches
+    # for each of the given speeches.
+    def search(self, speeches, j):
+        return([ self.rank(row, j) for row in self.similarity(self.vectors(speeches)) ])
+
+    # VectorStore().identify(mystery, j) returns the j closest matches
+    # for the named speech in the corpus directory.
+    def identify(self, mystery, j):
+        return(self.search([ Speech("{}{}.txt".format(self.directory, mystery), lean=True, stemmed=self.stemmed) ], j)[0])
+
+    # VectorStore().close() releases the mapping; the arrays must not
+    # be used afterwards.
+    def close(self):
+        self.matrix = self.norms = self.idf = None
+        self.map.close()
+
+# The AuthorIndex() class groups the rows of a matrix (dense, or a
+# SparseMatrix) with the given row norms by author (see authorOf()),
+# and holds the centroid of each author's rows: the mean of their
+# unit vectors. authors lists the authors in order of first
+# appearance, number maps each to its position there, members gives
+# the rows of each, and centroids and norms are the centroid matrix
+# (of the same kind as matrix) and its row norms.
+class AuthorIndex():
+    def __init__(self, matrix, norms, names):
+        self.authors = list(dict.fromkeys([ authorOf(name) for name in names ]))
+        self.number = { author:i for (i, author) in enumerate(self.authors) }
+        groups = np.array([ self.number[authorOf(name)] for name in names ], dtype=np.int64)
+        order = np.argsort(groups, kind='stable')
+        starts = np.flatnonzero(np.diff(groups[order], prepend=-1))
+        self.members = np.split(order, starts[1:])
+        sizes = np.bincount(groups, minlength=len(self.authors)).astype(np.float64)
+        scale = np.divide(1.0, norms, out=np.zeros(len(norms)), where=norms > 0)
+        if isinstance(matrix, SparseMatrix):
+            # Sum each author's unit rows by merging their entries with
+            # the same (author, column).
+            keys = groups[matrix.rows]*matrix.shape[1] + matrix.indices
+            keys, inverse = np.unique(keys, return_inverse=True)
+            data = np.bincount(inverse, weights=matrix.data*scale[matrix.rows]) / sizes[keys // matrix.shape[1]]
+            indptr = np.searchsorted(keys // matrix.shape[1], np.arange(len(self.authors) + 1))
+            self.centroids = SparseMatrix(indptr, keys % matrix.shape[1], data, matrix.shape[1])
+            self.norms = self.centroids.rowNorms()
+        else:
+            units = matrix[order] * scale[order, None]
+            self.centroids = np.add.reduceat(units, starts, axis=0) / sizes[:, None] if len(order) else np.zeros((0, matrix.shape[1]))
+            self.norms = np.sqrt(np.einsum('ij,ij->i', self.centroids, self.centroids))
+
+# The HashedCorpus() class is an alternative to Corpus() that needs no
+# vocabulary: speeches are vectorized on their own, as soon as they
+# are read, by hashing their features into a fixed number (width) of
+# columns (see hashFeatures()). The only corpus-wide state is the
+# document frequency of each column, a fixed-size array, so two
+# HashedCorpus objects built separately (e.g., by different workers)
+# with the same settings can simply be merged. IDF weights are applied
+# when scoring, as in Corpus().weigh(). The options are those of
+# hashSpeech().
+class HashedCorpus():
+    def __init__(self, directory="corpus/", width=1<<18, bigrams=True, chars=0, stemmed=False):
+        self.directory = directory
+        self.width = width
+        self.bigrams = bigrams
+        self.chars = chars
+        self.stemmed = stemmed
+        # Document frequency of each column.
+        self.dfreq = np.zeros(width, dtype=np.int64)
+        # Speech names, and the hashed feature columns, counts and
+        # length of each.
+        self.names = []
+        self.keys = []
+        self.counts = []
+        self.lengths = []
+        # The weighted matrix, its row norms and the IDF weights, made
+        # when first needed (see weigh()).
+        self.matrix = None
+        self.norms = None
+        self.idf = None
+        self.k = None
+
+    # HashedCorpus().options() returns the hashing options, for
+    # hashSpeech().
+    def options(self):
+        return({ 'width':self.width, 'bigrams':self.bigrams, 'chars':self.chars, 'stemmed':self.stemmed })
+
+    # HashedCorpus().hashSpeeches(filenames, workers) applies
+    # hashSpeech() to each of the filenames, in a pool of worker
+    # processes, as countSpeeches() does.
+    def hashSpeeches(self, filenames, workers=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        hasher = partial(hashSpeech, **self.options())
+        if workers <= 1 or len(filenames) <= 1:
+            return([ hasher(filename) for filename in filenames ])
+        with ProcessPoolExecutor(max_workers=min(workers, len(filenames))) as pool:
+            return(list(pool.map(hasher, filenames, chunksize=max(1, len(filenames)//(4*workers)))))
+
+    # HashedCorpus().add(name, keys, counts, length) adds a speech by
+    # its hashed features and length.
+    def add(self, name, keys, counts, length):
+        self.names.append(name)
+        self.keys.append(keys)
+        self.counts.append(counts)
+        self.lengths.append(length)
+        self.dfreq[keys] += 1
+        self.matrix = None
+
+    # HashedCorpus().addSpeeches(names, workers) hashes the named
+    # speeches (see hashSpeeches()) and adds them, in order. Speeches
+    # are not checked for duplicates.
+    def addSpeeches(self, names, workers=None):
+        filenames = [ "{}{}.txt".format(self.directory, name) for name in names ]
+        for name, (stamp, keys, counts, length) in zip(names, self.hashSpeeches(filenames, workers)):
+            self.add(name, keys, counts, length)
+
+    # HashedCorpus().merge(other) adds the speeches of other, which
+    # must have been made with the same options.
+    def merge(self, other):
+        if other.options() != self.options():
+            raise ValueError("can not merge HashedCorpus objects with different options")
+        self.names.extend(other.names)
+        self.keys.extend(other.keys)
+        self.counts.extend(other.counts)
+        self.lengths.extend(other.lengths)
+        self.dfreq += other.dfreq
+        self.matrix = None
+
+    # HashedCorpus().termFrequencies(keys, counts, lengths) returns the
+    # SparseMatrix of normalized term frequencies for the given rows.
+    def termFrequencies(self, keys, counts, lengths):
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([ len(row) for row in keys ], out=indptr[1:])
+        if not keys:
+            return(SparseMatrix(indptr, [], [], self.width))
+        scale = np.repeat([ 1.0/length if length else 1.0 for length in lengths ], np.diff(indptr))
+        return(SparseMatrix(indptr, np.concatenate(keys), np.concatenate(counts)*scale, self.width))
+
+    # HashedCorpus().weigh() computes the IDF weights from the document
+    # frequencies (with zero weight for columns in every document, or
+    # in none), and from them the weighted matrix and its row norms.
+    def weigh(self):
+        N = len(self.names)
+        with np.errstate(divide='ignore'):
+            self.idf = np.log(N/(1 + self.dfreq.astype(np.float64)))
+        self.idf[(self.dfreq == N) | (self.dfreq == 0)] = 0.0
+        self.matrix = self.termFrequencies(self.keys, self.counts, self.lengths).scale(self.idf)
+        self.norms = self.matrix.rowNorms()
+
+    # The scoring and ranking are those of Corpus().
+    similarity = Corpus.similarity
+    rank = Corpus.rank
+
+    # HashedCorpus().identifyMany(mysteries, j, workers) returns the j
+    # closest matches for each of the named mystery speeches.
+    def identifyMany(self, mysteries, j, workers=None):
+        if not mysteries:
+            return([])
+        if self.matrix is None:
+            self.weigh()
+        filenames = [ "{}{}.txt".format(self.directory, mystery) for mystery in mysteries ]
+        hashed = self.hashSpeeches(filenames, workers)
+        queries = self.termFrequencies(*zip(*[ (keys, counts, length) for (stamp, keys, counts, length) in hashed ])).scale(self.idf)
+        return([ self.rank(row, j) for row in self.similarity(queries) ])
+
+    # HashedCorpus().identify(mystery, j) is identifyMany() for a single
+    # mystery.
+    def identify(self, mystery, j):
+        return(self.identifyMany([ mystery ], j, workers=1)[0])
 
 # The Speech() class represents an speech, read from the specified
 # filename.  
 class Speech():
+    # Speeches can be numerous, so instances carry no __dict__, only
+    # these attributes. The text, sentences and words are properties
+    # backed by self.parsed (see parse() below), and the word
+    # frequencies are a property backed either by the dictionary
+    # self.table or, once the Speech has joined a Corpus, by the
+    # arrays self.ids and self.counts (see intern() below). Re-reads of
+    # a lean Speech are counted in self.rereads and self.rereadBytes.
+    __slots__ = ('filename', 'stamp', 'digest', 'parsed', 'table', 'ids', 'counts', 'vocabulary', 'length', 'vector', 'rereads', 'rereadBytes')
+
     # Most of the work takes place in the constructor, which must open
     # the file, read in the text, and store three representations of
     # the text in instance variables as follows.
@@ -135,64 +1900,201 @@ class Speech():
     # In addition, the constructor produces word frequency counts for
     # the document using non-stopwords only.
     #
-    # Note: Makes use of several "helper" functions.
-    def __init__(self, filename):
-        # The expandWord(word) helper function is used to apply a
-        # series of regular experssion substitutions to expand
-        # contractions and flush possessives. The goal here is to
-        # eliminate all of the embedded "'" characters.
-        def expandWord(word):
-            i = 0
-            while "'" in word and i < len(REGEXP):
-                word =re.sub(REGEXP[i][0], REGEXP[i][1], word)
-                i = i+1
-            return(word)
-
-        # The expandText(text) helper function "normalizes" the input
-        # text, producing a cleaned up version consisting of words
-        # without any embedded "'". Case and other elements are left
-        # unchanged.
-        def expandText(text):
-            return(''.join([expandWord(word) for word in text.split()]))
-
-        # The flushMarks(m) helper function is used to remove
-        # extraneous punctuation marks while replacing ? and ! with
-        # . to have a uniform EOS mark.
-        def flushMarks(m):
-            if m.group(1) in ('--', '-', '—', '_'):
-                return(' ') 
-            elif m.group(1) in ('(', ')', ',', ':', '\'', '"', '...'):
-                return('')
-            elif m.group(1) in ('?', '!'):
-                return('.')
-
+    # The constructor also records self.filename, self.stamp (see
+    # fileStamp()) and self.length, the number of words, which is all
+    # a Speech needs to make its vector.
+    #
+    # If lean is True, the file is instead streamed through tokenize()
+    # and only the word frequencies and length are kept; the text,
+    # sentences and words are then regenerated from the file each
+    # time they are requested, which keeps a lean Speech several
+    # times smaller.
+    #
+    # If stemmed is True, the word frequencies and length are instead
+    # those of the stemmed, non-stop words given by stemTokenize(), as
+    # in corpus/parse.py; the text, sentences and words are unchanged.
+    #
+    # Note: Makes use of the normalize(), tokenize() and stemTokenize()
+    # helper functions.
+    def __init__(self, filename, lean=False, stemmed=False):
         # Here is the body of the __init__() method. It starts by
         # reading in the text of the speech, expanding any
         # contractions and dropping any possessives. It also strips
         # punctuation at word boundaries except for '.!?'  which
-        # define sentences, and are replaced with periods.
-        with open(filename, 'r') as infile:
-            self.text=re.sub("\\s+"," ",re.sub('(--|-|—|_|\\(|\\)|,|:|\'|"|\\.\\.\\.|\\?|!)',flushMarks,expandText(infile.read()))).strip()
+        # define sentences, and are replaced with periods. The file
+        # is stamped before it is read, so a concurrent edit can only
+        # make the stamp look stale, never fresh.
+        self.filename = filename
+        self.stamp = fileStamp(filename)
+        self.digest = None
+        self.vector = None
+        self.parsed = None
+        self.rereads = 0
+        self.rereadBytes = 0
+        if stemmed:
+            with open(filename, 'r') as infile:
+                self.count(stemTokenize(infile), ())
+            if not lean:
+                self.parsed = self.read()
+        elif lean:
+            with open(filename, 'r') as infile:
+                words = tokenize(infile)
+                self.count(words)
+        else:
+            self.parsed = self.read()
+            self.count(self.words)
+
+    # Speech().count(words, stopwords) sets self.length to the number
+    # of words, and creates a word frequency index in self.wfreq based
+    # on the words but ignoring any of the given stop words (SW by
+    # default). Words may be any iterable, so they need not all be
+    # held in memory at once. The words are counted by Counter(), in
+    # C, and the stop words removed afterwards; either way, the index
+    # is ordered by first appearance.
+    def count(self, words, stopwords=SW):
+        wfreq = Counter(words)
+        self.length = sum(wfreq.values())
+        for word in [ word for word in stopwords if word in wfreq ]:
+            del wfreq[word]
+        self.wfreq = dict(wfreq)
+
+    # Speech().wfreq is the word frequency index, as a dictionary;
+    # setting it replaces any interned ids and counts. Once the Speech
+    # is interned (see intern()), each access builds a new dictionary
+    # from the arrays: read it once rather than once per word, and note
+    # that changing the dictionary returned does not change the Speech
+    # (assign a new wfreq instead).
+    @property
+    def wfreq(self):
+        if self.table is not None:
+            return(self.table)
+        return(dict(zip(self.vocabulary.decode(self.ids), self.counts.tolist())))
+
+    @wfreq.setter
+    def wfreq(self, wfreq):
+        self.table = wfreq
+        self.ids = None
+        self.counts = None
+        self.vocabulary = None
+
+    # Speech().intern(vocabulary) returns the word frequencies as a
+    # pair of arrays, the word ids (numbering any new words in the
+    # given Vocabulary) and their counts, in the order of self.wfreq.
+    # The arrays replace the dictionary, which a Corpus with many
+    # speeches would otherwise hold many copies of its words in.
+    def intern(self, vocabulary):
+        if self.vocabulary is not vocabulary:
+            table = self.wfreq
+            ids = vocabulary.intern(table)
+            counts = np.fromiter(table.values(), dtype=np.uint32, count=len(table))
+            self.adopt(vocabulary, ids, counts)
+        return((self.ids, self.counts))
+
+    # Speech().adopt(vocabulary, ids, counts) sets the word frequencies
+    # to the given arrays of word ids (in the given Vocabulary) and
+    # counts.
+    def adopt(self, vocabulary, ids, counts):
+        self.table = None
+        self.ids = ids
+        self.counts = counts
+        self.vocabulary = vocabulary
+
+    # Speech().parse() returns the (text, sentences, words) triple,
+    # which is kept in self.parsed unless the Speech is lean. A lean
+    # Speech re-reads its file (see read()) every time, counting the
+    # re-reads and their bytes in self.rereads and self.rereadBytes
+    # (see Corpus().metrics()). A lean Speech made from a text or
+    # stream (see fromStream()) has no file to read again, so it
+    # raises ValueError.
+    def parse(self):
+        if self.parsed is not None:
+            return(self.parsed)
+        if self.filename is None:
+            raise ValueError("speech has no file to re-read")
+        parsed = self.read()
+        self.rereads += 1
+        self.rereadBytes += os.path.getsize(self.filename)
+        return(parsed)
+
+    # Speech().read() reads and normalizes the text of the speech
+    # file, returning the (text, sentences, words) triple.
+    def read(self):
+        with open(self.filename, 'r') as infile:
+            text=normalize(infile.read())
 
         # Next, create a list of sentences, including stopwords, and
         # leaving the case unchanged.
-        self.sentences=[ sentence.strip() for sentence in self.text.split('.') if sentence != '' ]
+        sentences=[ sentence.strip() for sentence in text.split('.') if sentence != '' ]
 
         # Next, create a list of lower-case words in sequential order,
         # stripping any remaining punctuation (only periods remain)
-        self.words=[ word.strip('.').strip() for word in self.text.lower().split() if word != '.' ]
+        words=[ word.strip('.') for word in text.lower().split() if word != '.' ]
+        return((text, sentences, words))
 
-        # Finally, create a word frequency index in self.wfreq based
-        # on the words in self.words but ignoring any stop words in
-        # SW.
-        
-        self.wfreq = {}
-        for word in self.words:
-            if word not in SW:
-                try:
-                    self.wfreq[word] += 1
-                except:
-                    self.wfreq[word] = 1
+    @property
+    def text(self):
+        return(self.parse()[0])
+
+    @property
+    def sentences(self):
+        return(self.parse()[1])
+
+    @property
+    def words(self):
+        return(self.parse()[2])
+
+    # Speech.restore(filename, stamp, digest, wfreq, length) rebuilds
+    # a lean Speech from the counts recorded in a Corpus index (or
+    # returned by countSpeech()) without parsing the file.
+    @classmethod
+    def restore(cls, filename, stamp, digest, wfreq, length):
+        speech = cls.__new__(cls)
+        speech.filename = filename
+        speech.stamp = stamp
+        speech.digest = digest
+        speech.parsed = None
+        speech.rereads = 0
+        speech.rereadBytes = 0
+        speech.wfreq = wfreq
+        speech.length = length
+        speech.vector = None
+        return(speech)
+
+    # Speech.fromStream(infile, stemmed, filename) makes a lean Speech
+    # by streaming the open text stream infile (e.g., a member of an
+    # archive, see readSpeeches()) through the tokenizer. If filename
+    # is given, it is the file infile reads, which is stamped first;
+    # otherwise the Speech can not be re-parsed.
+    @classmethod
+    def fromStream(cls, infile, stemmed=False, filename=None):
+        speech = cls.restore(filename, None if filename is None else fileStamp(filename), None, None, 0)
+        if stemmed:
+            speech.count(stemTokenize(infile), ())
+        else:
+            speech.count(tokenize(infile))
+        return(speech)
+
+    # Speech.fromText(text, stemmed) makes a lean Speech from the given
+    # text instead of a file (e.g., a mystery speech sent to the server
+    # in server.py). It has no filename, so it can not be re-parsed.
+    @classmethod
+    def fromText(cls, text, stemmed=False):
+        return(cls.fromStream(io.StringIO(text), stemmed))
+
+    # Speech().current() returns True if the speech file is unchanged
+    # since it was parsed: either its stamp matches, or its stamp has
+    # moved but its content hash has not.
+    def current(self):
+        try:
+            stamp = fileStamp(self.filename)
+        except OSError:
+            return(False)
+        if stamp == self.stamp:
+            return(True)
+        if self.digest is not None and fileDigest(self.filename) == self.digest:
+            self.stamp = stamp
+            return(True)
+        return(False)
 
     # Speech().makeVector(template, dfreq, N) takes a template (an
     # ordered list of words), the dfreq dictionary of document
@@ -207,12 +2109,14 @@ class Speech():
     # document frequency adjusted to avoid divide-by-zero errors
     # (i.e., log(N/(1+dfreq(t))).
     def makeVector(self, template, dfreq, N):
-        self.vector = []
+        vector = []
+        wfreq = self.wfreq
         for word in template:
             try:
-                self.vector.append((self.wfreq[word]/len(self.words))*log(N / (1+dfreq[word])))
+                vector.append((wfreq[word]/self.length)*log(N / (1+dfreq[word])))
             except:
-                self.vector.append(0.0)
+                vector.append(0.0)
+        self.vector = np.array(vector)
 
     # Cosine similarity of two vectors is computed as the dot product
     # divided by the cross product of the two vectors, defined as the
@@ -223,11 +2127,11 @@ class Speech():
         # which is the square root of the sum of the squares of the
         # vector elements.
         def vectorMagnitude(vector):
-            return(sqrt(sum([ val*val for val in vector ])))
+            return(sqrt(np.dot(vector, vector)))
         # Compute the dot product and divide by the product of the
         # individual vector magnitudes.
         # Calculate the dot product of the two vectors    
-        dot_product = sum([ pair[0]*pair[1] for pair in zip(self.vector, other.vector) ])
+        dot_product = float(np.dot(self.vector, other.vector))
         
         # Calculate the magnitudes of the two vectors
         self_magnitude = vectorMagnitude(self.vector)
@@ -242,10 +2146,9 @@ class Speech():
 
 
 if __name__ == '__main__':
-    c=Corpus()
-    for p in P:
-        for i in range(4):
-            c.addSpeech(p + str(i))
-    for u in U:
-        print("Mystery speech {} is closest to: {}".format(u[-1], c.identify(u, 2000, 4)))
+    c=Corpus(index="hw3.idx")
+    c.addSpeeches([ p + str(i) for p in P for i in range(4) ])
+    for u, matches in zip(U, c.identifyMany(U, 2000, 4)):
+        print("Mystery speech {} is closest to: {}".format(u[-1], matches))
+    c.save()
     
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import hw3
+
+# A long-running identify server for hw3.py. The Corpus is loaded
+# once (from its index, if there is one) and its vectors are kept
+# warm, so that each request costs only the parsing and scoring of
+# one mystery speech. Start it with, e.g.,
+#
+#   python server.py --socket /tmp/hw3.sock
+#
+# (or --port to listen on localhost instead). Clients send one JSON
+# object per line, naming a speech file in the corpus directory or
+# carrying the raw text of a speech, and optionally k and j:
+#
+#   {"name": "unknown1"}
+#   {"text": "Fellow citizens ...", "k": 500, "j": 10}
+#
+# and get back one JSON object per line, either
+#
+#   {"matches": [[0.31, "obama2"], ...]}  or  {"error": "..."}
+#
+# echoing any "id" given in the request.
+#
+# Several servers can share one copy of the vectors by serving a
+# vector store exported by Corpus().export() (see VectorStore()):
+#
+#   python server.py --socket /tmp/hw3-1.sock --store hw3.vec
+#
+# in which case only the exported k can be asked for.
+
+# The Server() class answers identify requests against a Corpus.
+# Requests that arrive within window seconds of each other (up to
+# batch of them) are scored together in one pass (see flush()), which
+# costs little more than scoring one of them alone. Mysteries of inline
+# bytes or more are parsed in a pool of (up to workers) worker
+# processes, so that a long one does not hold up the batches of other
+# clients (shorter ones are parsed in place, which is quicker than
+# handing them over). The last parsed
+# mysteries (up to cache of them) are kept, so that a speech asked
+# about again need not be parsed again.
+class Server():
+    def __init__(self, corpus, k=2000, j=4, window=0.001, batch=64, cache=256, inline=1<<16, workers=2):
+        self.corpus = corpus
+        self.k = k
+        self.j = j
+        self.window = window
+        self.batch = batch
+        self.cache = cache
+        self.inline = inline
+        self.workers = workers
+        self.pool = None
+        self.parsed = OrderedDict()
+        # Requests waiting to be scored, as (k, speech, j, future)
+        # tuples, and the timer that will flush them.
+        self.pending = []
+        self.timer = None
+        # Counts of requests answered and batches scored.
+        self.requests = 0
+        self.batches = 0
+        corpus.useVectors(k)
+
+    # Server().speech(request) returns the mystery Speech for the
+    # request, read from the corpus directory or made from its text
+    # (by a worker process, if it is long; see countSpeech() and
+    # countText()). Speeches read from files are re-read if the file
+    # has changed.
+    async def speech(self, request):
+        if 'text' in request:
+            if not isinstance(request['text'], str):
+                raise ValueError("text must be a string")
+            key = ('text', request['text'])
+        elif 'name' in request:
+            name = request['name']
+            if not isinstance(name, str) or not name or os.path.basename(name) != name:
+                raise ValueError("bad speech name {!r}".format(name))
+            key = ('name', "{}{}.txt".format(self.corpus.directory, name))
+        else:
+            raise ValueError("request needs a name or a text")
+        speech = self.parsed.pop(key, None)
+        if speech is None or (key[0] == 'name' and not speech.current()):
+            if key[0] == 'text':
+                size = len(key[1])
+            else:
+                size = os.path.getsize(key[1])
+            if size < self.inline:
+                if key[0] == 'text':
+                    speech = hw3.Speech.fromText(key[1], self.corpus.stemmed)
+                else:
+                    speech = hw3.Speech(key[1], lean=True, stemmed=self.corpus.stemmed)
+            else:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                loop = asyncio.get_running_loop()
+                if key[0] == 'text':
+                    wfreq, length = await loop.run_in_executor(self.pool, hw3.countText, key[1], self.corpus.stemmed)
+                    speech = hw3.Speech.restore(None, None, None, wfreq, length)
+                else:
+                    stamp, wfreq, length = await loop.run_in_executor(self.pool, hw3.countSpeech, key[1], self.corpus.stemmed)
+                    speech = hw3.Speech.restore(key[1], stamp, None, wfreq, length)
+        if self.cache > 0:
+            self.parsed[key] = speech
+            if len(self.parsed) > self.cache:
+                self.parsed.popitem(last=False)
+        return(speech)
+
+    # Server().identify(request) returns the matches for the request,
+    # once the batch it joins has been scored.
+    async def identify(self, request):
+        k = request.get('k', self.k)
+        j = request.get('j', self.j)
+        if not (k is None or (isinstance(k, int) and k > 0)) or not (isinstance(j, int) and j > 0):
+            raise ValueError("k and j must be positive integers")
+        speech = await self.speech(request)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((k, speech, j, future))
+        if len(self.pending) >= self.batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return(await future)
+
+    # Server().flush() scores all the pending requests, one search per
+    # value of k among them, and hands each its matches.
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, []
+        self.batches += 1
+        for key in dict.fromkeys([ item[0] for item in pending ]):
+            items = [ item for item in pending if item[0] == key ]
+            try:
+                self.corpus.useVectors(key)
+                results = self.corpus.search([ speech for (k, speech, j, future) in items ], max([ item[2] for item in items ]))
+            except Exception as e:
+                for (k, speech, j, future) in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (k, speech, j, future), matches in zip(items, results):
+                if not future.done():
+                    future.set_result(matches[:j])
+            self.requests += len(items)
+
+    # Server().close() shuts down the worker processes, if any.
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # Server().handle(reader, writer) answers the requests on one
+    # connection, in order, until the client hangs up.
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    if 'id' in request:
+                        response['id'] = request['id']
+                    response['matches'] = await self.identify(request)
+                except Exception as e:
+                    response['error'] = str(e) or type(e).__name__
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Server().start(path, port) starts listening on the Unix socket
+    # at path or, if path is None, on the given localhost port, and
+    # returns the asyncio server.
+    async def start(self, path=None, port=8765):
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)
+            return(await asyncio.start_unix_server(self.handle, path, limit=1<<26))
+        return(await asyncio.start_server(self.handle, '127.0.0.1', port, limit=1<<26))
+
+# connect(path, port) opens a client connection to a Server, returning
+# the (reader, writer) pair for use with ask().
+async def connect(path=None, port=8765):
+    if path is not None:
+        return(await asyncio.open_unix_connection(path, limit=1<<26))
+    return(await asyncio.open_connection('127.0.0.1', port, limit=1<<26))
+
+# ask(connection, request) sends one request over a connection made
+# by connect() and returns the decoded response.
+async def ask(connection, request):
+    reader, writer = connection
+    writer.write((json.dumps(request) + '\n').encode())
+    await writer.drain()
+    return(json.loads(await reader.readline()))
+
+# Load (or build) the Corpus of all the known speeches, as in hw3.py,
+# or open the given vector store, and serve it until interrupted.
+async def main(args):
+    k = None if args.k == 0 else args.k
+    if args.store is not None:
+        corpus = hw3.VectorStore(args.store)
+        k = corpus.k
+    else:
+        corpus = hw3.Corpus(index=args.index)
+        corpus.addSpeeches([ p + str(i) for p in hw3.P for i in range(4) ], args.workers)
+        if args.index is not None:
+            corpus.save()
+    server = Server(corpus, k, args.j, args.window/1000, args.batch, args.cache, args.inline, args.workers)
+    listener = await server.start(args.socket, args.port)
+    print("serving {} speeches on {}".format(len(corpus.names), args.socket or "127.0.0.1:{}".format(args.port)), file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve hw3 identify requests.")
+    parser.add_argument('--socket', help="Unix socket path to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="localhost port to listen on, if no --socket")
+    parser.add_argument('--index', default="hw3.idx", help="Corpus index file")
+    parser.add_argument('--store', help="vector store file to serve instead of the Corpus")
+    parser.add_argument('--workers', type=int, default=None, help="processes for parsing the corpus and long mysteries")
+    parser.add_argument('-k', type=int, default=2000, help="default template size (0 for the full vocabulary)")
+    parser.add_argument('-j', type=int, default=4, help="default number of matches")
+    parser.add_argument('--window', type=float, default=1.0, help="batching window, in milliseconds")
+    parser.add_argument('--batch', type=int, default=64, help="largest batch")
+    parser.add_argument('--cache', type=int, default=256, help="number of parsed mysteries to keep")
+    parser.add_argument('--inline', type=int, default=1<<16, help="size in bytes from which mysteries are parsed by worker processes")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass